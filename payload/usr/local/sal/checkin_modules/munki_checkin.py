@@ -8,15 +8,13 @@ import sys
 
 import sal
 
-from Foundation import CFPreferencesCopyAppValue, NSDate
-
 __version__ = "1.2.0"
 
 
 def munkiPref(pref_name):
-    pref_value = CFPreferencesCopyAppValue(pref_name, "ManagedInstalls")
-    if isinstance(pref_value, NSDate):
-        # convert NSDate/CFDates to strings
+    pref_value = sal.munki_pref(pref_name)
+    if isinstance(pref_value, datetime.datetime):
+        # convert dates to strings
         pref_value = str(pref_value)
     return pref_value
 
@@ -1,9 +1,91 @@
-from sal.client import MacKeychainClient, SalClient, get_sal_client
+"""Sal client utilities.
+
+Everything is available from the package itself (`sal.sal_pref`,
+`sal.get_sal_client`, ...), but only `sal.utils` is imported up front.
+The other modules, and their dependencies like requests and PyObjC,
+are imported the first time one of their names is used, so scripts
+only pay for what they use.
+"""
+
+
+import importlib
 
-try:
-    from sal.mac_utils import *
-except ImportError:
-    # Allow non-macOS to import safely.
-    pass
 from sal.utils import *
 from sal.version import __version__
+
+
+# Names provided by each lazily imported module.
+_LAZY_EXPORTS = {
+    "sal.client": (
+        "AsyncSalClient",
+        "MacKeychainClient",
+        "ResponseCache",
+        "RetryPolicy",
+        "SalClient",
+        "get_sal_client",
+    ),
+    "sal.delta": ("CheckinState",),
+    "sal.mac_utils": (
+        "ISO_TIME_FORMAT",
+        "script_is_running",
+        "setup_sal_client",
+        "wait_for_script",
+    ),
+    "sal.metrics": ("LAST_RUN_METRICS_PATH", "NetworkMetrics", "RequestMetrics"),
+    "sal.prefs": (
+        "BUNDLE_ID",
+        "CFPreferencesBackend",
+        "DEFAULT_PREFS",
+        "MUNKI_BUNDLE_ID",
+        "PlistBackend",
+        "PrefsSnapshot",
+        "REPORTED_PREFS",
+        "forced",
+        "mac_pref",
+        "munki_pref",
+        "prefs_report",
+        "prefs_snapshot",
+        "refresh_sal_pref",
+        "sal_pref",
+        "set_prefs_snapshot",
+        "set_sal_pref",
+    ),
+    "sal.runner": ("ScriptResult", "run_scripts"),
+    "sal.spool": ("Spool",),
+}
+_LAZY_ATTRS = {
+    name: module for module, names in _LAZY_EXPORTS.items() for name in names
+}
+_SUBMODULES = (
+    "client",
+    "delta",
+    "exceptions",
+    "mac_utils",
+    "metrics",
+    "prefs",
+    "runner",
+    "spool",
+)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"sal.{name}")
+    if name not in _LAZY_ATTRS:
+        raise AttributeError(f"module 'sal' has no attribute '{name}'")
+    try:
+        module = importlib.import_module(_LAZY_ATTRS[name])
+    except ImportError as error:
+        if _LAZY_ATTRS[name] != "sal.mac_utils":
+            raise
+        # Allow non-macOS to import safely; the macOS-only names just
+        # aren't there.
+        raise AttributeError(f"module 'sal' has no attribute '{name}'") from error
+    value = getattr(module, name)
+    # Cached, so this is only called once per name.
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | _LAZY_ATTRS.keys() | set(_SUBMODULES))
@@ -1,38 +1,343 @@
+import asyncio
+import base64
+import concurrent.futures
+import email.utils
+import functools
+import gzip
+import hashlib
 import logging
 import os
+import pathlib
+import platform
+import random
+import socket
+import threading
+import time
+import urllib.parse
 
 try:
     from macsesh import Session as MacSeshSession
 except ImportError:
     MacSeshSession = None
 import requests
+import requests.adapters
+import urllib3.connection
+import urllib3.connectionpool
+import urllib3.exceptions
+from urllib3.util.ssl_ import create_urllib3_context
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from sal import metrics
+from sal.exceptions import CircuitOpenError
+from sal.utils import atomic_write, json_dumps, read_json
 
 
+RESPONSE_CACHE_PATH = {"Darwin": "/usr/local/sal/response_cache.json"}.get(
+    platform.system()
+)
 _client_instance = None
 
 
+class RetryPolicy:
+    """How many times, and how patiently, SalClient retries a request.
+
+    Requests are retried after connection errors, timeouts and any of
+    the retry statuses. Waits between attempts back off exponentially
+    from `backoff` seconds, up to `max_backoff`, with up to `jitter`
+    (as a fraction of the wait) added at random so that a fleet of
+    clients doesn't retry in lockstep. A Retry-After header on a 429
+    or 503 response is honored instead, up to `max_backoff`.
+    """
+
+    def __init__(
+        self,
+        attempts=3,
+        backoff=1.0,
+        max_backoff=30.0,
+        jitter=0.5,
+        statuses=(429, 502, 503, 504),
+    ):
+        self.attempts = max(1, int(attempts))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.statuses = set(statuses)
+
+    def delay(self, attempt, response=None):
+        """Return seconds to wait before retrying after attempt (from 1)."""
+        if response is not None and response.status_code in (429, 503):
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return delay + random.uniform(0, self.jitter * delay)
+
+
+class CircuitBreaker:
+    """Stops a run contacting a server that is clearly down.
+
+    After `threshold` requests in a row have failed (after retries) with
+    a connection error, timeout or 5xx response, the breaker opens and
+    further requests fail immediately with CircuitOpenError. A
+    threshold of 0 disables the breaker.
+    """
+
+    def __init__(self, threshold=2):
+        self.threshold = threshold
+        self.failures = 0
+
+    @property
+    def open(self):
+        return bool(self.threshold) and self.failures >= self.threshold
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+
+
+class ResponseCache:
+    """An on-disk cache of responses for conditional requests.
+
+    Responses carrying an ETag or Last-Modified header are kept, and
+    later requests for the same thing send If-None-Match or
+    If-Modified-Since. When the server answers 304 Not Modified, the
+    cached response is returned in its place, with `from_cache` set.
+    Only the newest `max_entries` responses are kept.
+    """
+
+    max_entries = 32
+
+    def __init__(self, path=None):
+        self.path = pathlib.Path(path or RESPONSE_CACHE_PATH)
+        self.lock = threading.Lock()
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = read_json(self.path)
+        return self._entries
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def update(self, key, entry, response):
+        """Store response, or return the cached one if it's unmodified."""
+        if response.status_code == 304 and entry:
+            return _cached_response(entry, response)
+        if response.status_code != 200:
+            return response
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        with self.lock:
+            if etag or last_modified:
+                self.entries[key] = {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "content_type": response.headers.get("Content-Type"),
+                    "body": base64.b64encode(response.content).decode(),
+                    "stored": time.time(),
+                }
+                for old in sorted(
+                    self.entries, key=lambda k: self.entries[k]["stored"]
+                )[: -self.max_entries]:
+                    del self.entries[old]
+            elif self.entries.pop(key, None) is None:
+                return response
+            self.save()
+        return response
+
+    def save(self):
+        try:
+            atomic_write(self.path, json_dumps(self.entries))
+        except OSError as error:
+            logging.warning(f"Failed to save response cache: {error}")
+
+
+class TimedConnectionMixin:
+    """Times DNS, TCP connect and TLS setup of new connections.
+
+    The host is looked up here, timed, and its addresses connected to
+    in turn, so that urllib3 doesn't look it up again.
+    """
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(
+                self._dns_host, self.port, type=socket.SOCK_STREAM
+            )
+        except OSError:
+            # Let urllib3's own lookup report the error in its usual form.
+            return super()._new_conn()
+        metrics.timed("dns", start)
+
+        start = time.perf_counter()
+        host = self._dns_host
+        try:
+            for *_, sockaddr in addresses[:-1]:
+                self._dns_host = sockaddr[0]
+                try:
+                    conn = super()._new_conn()
+                    break
+                except (
+                    urllib3.exceptions.NewConnectionError,
+                    urllib3.exceptions.ConnectTimeoutError,
+                ):
+                    continue
+            else:
+                self._dns_host = addresses[-1][4][0]
+                conn = super()._new_conn()
+        finally:
+            self._dns_host = host
+        metrics.timed("connect", start)
+        metrics.count("connections")
+        return conn
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        elapsed = time.perf_counter() - start
+        timings = getattr(metrics.connection_timings, "current", None)
+        if timings is not None and self.is_https:
+            setup = timings.get("dns", 0) + timings.get("connect", 0)
+            timings["tls"] = round(max(0.0, elapsed - setup), 6)
+
+
+class TimedHTTPConnection(TimedConnectionMixin, urllib3.connection.HTTPConnection):
+    is_https = False
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, urllib3.connection.HTTPSConnection):
+    is_https = True
+
+
+class TimedHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class SalHTTPAdapter(requests.adapters.HTTPAdapter):
+    """An HTTPAdapter that loads its TLS configuration once.
+
+    requests normally hands the CA bundle and client certificate paths
+    to urllib3, which loads them again for every connection it opens.
+    This adapter loads them into one SSL context up front and shares it
+    between all of its connections, and times the connections it opens
+    for the client's metrics.
+    """
+
+    def __init__(self, verify=True, cert=None, **kwargs):
+        self.verify = verify
+        self.cert = cert
+        self.ssl_context = create_ssl_context(verify, cert)
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = self.ssl_context
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if verify == self.verify and cert == self.cert:
+            # Already loaded into the shared context.
+            conn.ca_certs = conn.ca_cert_dir = None
+            conn.cert_file = conn.key_file = None
+
+
 class SalClient:
     session_class = requests.Session
+    # Connections kept open to the server; enough for concurrent
+    # catalog uploads to each keep their own.
+    pool_maxsize = 8
+    _session = None
     _base_url = ""
     _auth = None
     _cert = None
     _verify = None
     basic_timeout = (3.05, 4)
     post_timeout = (3.05, 8)
+    # (connect, read) timeouts for specific endpoints, overriding the
+    # basic or post timeouts, e.g. {"checkin": (3.05, 15)}.
+    endpoint_timeouts = {}
+    # Request bodies are allowed this many bytes per second of upload
+    # on top of their read timeout, so that big reports on slow links
+    # don't time out.
+    upload_bytes_per_second = 128 * 1024
+    # Content-Encoding to use for JSON request bodies: "gzip", "zstd"
+    # or None to send them uncompressed.
+    compression = None
+    # After the server answers a compressed body with 415, bodies are
+    # sent uncompressed until this time.time(), when compression is
+    # tried again.
+    compression_rejected_until = 0
+    compression_retry_interval = 7 * 24 * 60 * 60
+    # A ResponseCache for requests made with cache=True, or None.
+    response_cache = None
 
     def __init__(self):
-        self.create_session()
+        self.retry_policy = RetryPolicy()
+        self.circuit_breaker = CircuitBreaker()
+        self.metrics = metrics.NetworkMetrics()
+
+    @property
+    def session(self):
+        """The client's session, created on first use.
+
+        Changing auth after that updates the session in place, keeping
+        its open connections; changing cert or verify replaces only its
+        connection pool.
+        """
+        if self._session is None:
+            self.create_session()
+        return self._session
 
     def create_session(self):
-        self.session = self.session_class()
+        if self._session is not None:
+            self._session.close()
+        self._session = self.session_class()
         if self.auth:
-            self.session.auth = self._auth
-        if self.cert:
-            self.session.cert = self._cert
-        if self.verify:
-            self.session.verify = self._verify
+            self._session.auth = self._auth
+        self.configure_tls()
 
-            # self.session.cert = (self._cert, self._key) if self._key else self._cert
+    def configure_tls(self):
+        self._session.cert = self._cert
+        if self.verify:
+            self._session.verify = self._verify
+        if self.session_class is requests.Session and self._session.verify:
+            adapter = SalHTTPAdapter(
+                verify=self._session.verify,
+                cert=self._cert,
+                pool_maxsize=self.pool_maxsize,
+            )
+            previous = self._session.adapters.get("https://")
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+            if isinstance(previous, SalHTTPAdapter):
+                previous.close()
 
     @property
     def base_url(self):
@@ -49,7 +354,8 @@ class SalClient:
     @auth.setter
     def auth(self, creds):
         self._auth = creds
-        self.create_session()
+        if self._session is not None:
+            self._session.auth = creds
 
     @property
     def cert(self):
@@ -58,7 +364,8 @@ class SalClient:
     @cert.setter
     def cert(self, cert, key=None):
         self._cert = (cert, key) if key else cert
-        self.create_session()
+        if self._session is not None:
+            self.configure_tls()
 
     @property
     def verify(self):
@@ -67,22 +374,228 @@ class SalClient:
     @verify.setter
     def verify(self, path):
         self._verify = path
-        self.create_session()
+        if self._session is not None:
+            self.configure_tls()
 
-    def get(self, url):
+    def get(self, url, cache=False, deadline=None):
+        """GET url.
+
+        With cache, the response is kept in the response cache and
+        revalidated with a conditional request next time. See `request`
+        for deadline.
+        """
         url = self.build_url(url)
-        return self.log_response(self.session.get(url, timeout=self.basic_timeout))
+        cache_key = _cache_key("GET", url) if cache else None
+        return self.log_response(
+            self.request("GET", url, cache_key=cache_key, deadline=deadline)
+        )
+
+    def post(
+        self, url, data=None, json=None, cache=False, deadline=None, compression=None
+    ):
+        """POST data (form fields) or json to url.
 
-    def post(self, url, data=None, json=None):
+        json may also be JSON already encoded as bytes. It is compressed
+        as configured by the client's `compression`, or else with the
+        compression given here, if any. See `get` for cache and
+        `request` for deadline.
+        """
         url = self.build_url(url)
-        kwargs = {"timeout": self.post_timeout}
+        cache_key = None
+        if cache:
+            body = _encode_json(json) if json else data
+            if isinstance(body, dict):
+                body = urllib.parse.urlencode(sorted(body.items())).encode()
+            cache_key = _cache_key("POST", url, body)
         if json:
-            kwargs["json"] = json
+            # Encode here rather than letting requests do it, so that
+            # datetimes and bytes are handled the same way as when
+            # results are saved.
+            body = _encode_json(json)
+            headers = {"Content-Type": "application/json"}
+            encoding = self.content_encoding(compression)
+            if encoding:
+                compressed = compress_body(body, encoding)
+                logging.debug(
+                    f"Compressed {url} body with {encoding}: {len(body)} -> "
+                    f"{len(compressed)} bytes"
+                )
+                response = self.request(
+                    "POST",
+                    url,
+                    data=compressed,
+                    headers={**headers, "Content-Encoding": encoding},
+                    cache_key=cache_key,
+                    raw_size=len(body),
+                    deadline=deadline,
+                )
+                if response.status_code != 415:
+                    return self.log_response(response)
+                logging.info(
+                    f"Server does not accept {encoding} request bodies; "
+                    "sending uncompressed."
+                )
+                self.compression_rejected_until = (
+                    time.time() + self.compression_retry_interval
+                )
+            response = self.request(
+                "POST",
+                url,
+                data=body,
+                headers=headers,
+                cache_key=cache_key,
+                deadline=deadline,
+            )
         else:
-            kwargs["data"] = data
-        return self.log_response(self.session.post(url, **kwargs))
+            response = self.request(
+                "POST", url, data=data, cache_key=cache_key, deadline=deadline
+            )
+        return self.log_response(response)
+
+    def request(
+        self,
+        method,
+        url,
+        data=None,
+        headers=None,
+        cache_key=None,
+        raw_size=None,
+        deadline=None,
+    ):
+        """Send a request, retrying according to the retry policy.
+
+        If cache_key is given and the client has a response cache, the
+        request is made conditional on any response cached under it.
+        The request is recorded in the client's metrics; raw_size is
+        the size of a compressed body before compression.
+
+        deadline is a `time.monotonic()` time by which to give up: each
+        attempt's timeouts are cut to the time left, and there are no
+        retries that would start after it.
+
+        raises: CircuitOpenError without sending anything if the circuit
+            breaker is open, requests.exceptions.Timeout if the deadline
+            has passed, or the last requests exception if every attempt
+            failed.
+        """
+        if self.circuit_breaker.open:
+            raise CircuitOpenError(
+                f"Not sending {method} {url}; the last "
+                f"{self.circuit_breaker.failures} requests to the server failed."
+            )
+
+        cache = self.response_cache if cache_key else None
+        entry = cache.get(cache_key) if cache else None
+        if entry:
+            headers = {**(headers or {}), **cache.conditional_headers(entry)}
+        body_size = _body_size(data)
+        request_metrics = metrics.RequestMetrics(
+            endpoint=url[len(self.base_url) :].strip("/"),
+            method=method,
+            request_bytes=body_size,
+            raw_request_bytes=raw_size or body_size,
+        )
+        start = time.perf_counter()
+        metrics.start_connection_timing()
+        try:
+            response = self._send_with_retries(
+                method, url, data, headers, request_metrics, deadline
+            )
+        except requests.exceptions.RequestException as error:
+            request_metrics.error = type(error).__name__
+            raise
+        finally:
+            request_metrics.total = round(time.perf_counter() - start, 6)
+            for name, value in metrics.finish_connection_timing().items():
+                setattr(request_metrics, name, value)
+            self.metrics.record(request_metrics)
+
+        request_metrics.status = response.status_code
+        request_metrics.response_bytes = len(response.content)
+        if cache:
+            response = cache.update(cache_key, entry, response)
+            request_metrics.from_cache = getattr(response, "from_cache", False)
+        return response
+
+    def _send_with_retries(
+        self, method, url, data, headers, request_metrics, deadline=None
+    ):
+        timeout = self.get_timeout(url, method, request_metrics.request_bytes)
+        attempt = 0
+        while True:
+            attempt += 1
+            request_metrics.attempts = attempt
+            attempt_timeout = _cap_timeout(timeout, deadline, f"{method} {url}")
+            try:
+                response = self.session.request(
+                    method, url, data=data, headers=headers, timeout=attempt_timeout
+                )
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as error:
+                delay = self.retry_policy.delay(attempt)
+                if attempt >= self.retry_policy.attempts or _too_late(deadline, delay):
+                    # A timeout cut short by the deadline isn't the server's fault.
+                    cut_short = attempt_timeout != timeout
+                    if not (
+                        cut_short and isinstance(error, requests.exceptions.Timeout)
+                    ):
+                        self.circuit_breaker.record_failure()
+                    raise
+                reason = str(error)
+            else:
+                retry = response.status_code in self.retry_policy.statuses
+                delay = self.retry_policy.delay(attempt, response) if retry else 0
+                if (
+                    not retry
+                    or attempt >= self.retry_policy.attempts
+                    or _too_late(deadline, delay)
+                ):
+                    if response.status_code >= 500:
+                        self.circuit_breaker.record_failure()
+                    else:
+                        self.circuit_breaker.record_success()
+                    return response
+                reason = f"HTTP {response.status_code}"
+
+            logging.info(
+                f"{method} {url} failed ({reason}); retrying in {delay:.1f}s "
+                f"(attempt {attempt + 1} of {self.retry_policy.attempts})"
+            )
+            time.sleep(delay)
+
+    def get_timeout(self, url, method="GET", body_size=0):
+        """Return the (connect, read) timeout for a request to url."""
+        endpoint = url[len(self.base_url) :].strip("/")
+        timeout = self.basic_timeout if method == "GET" else self.post_timeout
+        for prefix in sorted(self.endpoint_timeouts, key=len, reverse=True):
+            if endpoint.startswith(prefix):
+                timeout = self.endpoint_timeouts[prefix]
+                break
+        if body_size and self.upload_bytes_per_second:
+            connect, read = timeout
+            timeout = (connect, read + body_size / self.upload_bytes_per_second)
+        return timeout
+
+    def content_encoding(self, default=None):
+        """Return the Content-Encoding to use for request bodies, if any.
+
+        default is used if the client has no compression configured.
+        """
+        compression = self.compression or default
+        if not compression or time.time() < self.compression_rejected_until:
+            return None
+        if compression == "zstd" and zstandard is None:
+            return "gzip"
+        if compression not in ("gzip", "zstd"):
+            logging.warning(f"Unknown request compression '{compression}'")
+            return None
+        return compression
 
     def log_response(self, response):
+        if getattr(response, "from_cache", False):
+            logging.debug("Response not modified; using cached response")
         logging.debug(f"Response HTTP {response.status_code}: {response.text}")
         return response
 
@@ -96,6 +609,225 @@ class MacKeychainClient(SalClient):
     session_class = MacSeshSession
 
 
+class AsyncSalClient:
+    """An asyncio front end to a SalClient.
+
+    `get` and `post` are coroutines with the same arguments and results
+    as SalClient's. Each request runs on a worker thread through the
+    wrapped client, sharing its session, retry policy and circuit
+    breaker. At most `concurrency` requests are in flight at once.
+
+    If timeout (in seconds) is given, it is a deadline for everything
+    sent through this client: requests still waiting or running when it
+    passes raise requests.exceptions.Timeout. Each request's own
+    timeouts are cut to the time left, so that the worker threads of
+    abandoned requests finish by the deadline too. `to_thread` runs
+    other blocking work, like encoding uploads, under the same deadline,
+    and `until_deadline` bounds any other awaitable by it.
+    """
+
+    def __init__(self, client=None, concurrency=4, timeout=None):
+        self.client = client or get_sal_client()
+        self.concurrency = max(1, int(concurrency))
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self._executor = concurrent.futures.ThreadPoolExecutor(self.concurrency)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # Don't wait for requests abandoned at the deadline.
+        self._executor.shutdown(wait=False)
+
+    @property
+    def base_url(self):
+        return self.client.base_url
+
+    @property
+    def auth(self):
+        return self.client.auth
+
+    def build_url(self, url):
+        return self.client.build_url(url)
+
+    async def get(self, url, cache=False):
+        return await self._call(self.client.get, url, cache=cache)
+
+    async def post(self, url, data=None, json=None, cache=False):
+        return await self._call(
+            self.client.post, url, data=data, json=json, cache=cache
+        )
+
+    async def to_thread(self, func, *args, **kwargs):
+        """Call func on a new daemon thread.
+
+        Nothing is started once the deadline has passed, and waiting
+        for func stops at the deadline. func itself can't be stopped,
+        so it runs on, but neither asyncio.run nor interpreter exit
+        waits for it, as they would for asyncio.to_thread or executor
+        workers.
+        """
+        name = getattr(func, "__name__", repr(func))
+        if self._remaining() == 0.0:
+            raise requests.exceptions.Timeout(f"Deadline passed before {name} started")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def run():
+            try:
+                outcome = (future.set_result, func(*args, **kwargs))
+            except BaseException as error:
+                outcome = (future.set_exception, error)
+            try:
+                loop.call_soon_threadsafe(_settle, future, *outcome)
+            except RuntimeError:
+                # The loop has closed; no one is waiting any more.
+                pass
+
+        threading.Thread(target=run, name=f"sal-{name}", daemon=True).start()
+        return await self.until_deadline(future, name)
+
+    async def _call(self, func, *args, **kwargs):
+        if self._semaphore is None:
+            # Created here so that it belongs to the running loop.
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        return await self.until_deadline(
+            self._send(loop, func, *args, deadline=self.deadline, **kwargs), args[0]
+        )
+
+    async def until_deadline(self, awaitable, what):
+        """Await awaitable, giving up when the deadline passes.
+
+        raises: requests.exceptions.Timeout at the deadline, after
+            cancelling awaitable.
+        """
+        try:
+            return await asyncio.wait_for(awaitable, self._remaining())
+        except asyncio.TimeoutError:
+            raise requests.exceptions.Timeout(
+                f"Deadline passed before {what} completed"
+            ) from None
+
+    async def _send(self, loop, func, *args, **kwargs):
+        async with self._semaphore:
+            return await loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs)
+            )
+
+    def _remaining(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+
+def _settle(future, setter, value):
+    """Call setter (future's set_result or set_exception) unless it's done."""
+    if not future.done():
+        setter(value)
+
+
+def compress_body(body, encoding):
+    """Return body (bytes) compressed for the given Content-Encoding."""
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor().compress(body)
+    return gzip.compress(body, mtime=0)
+
+
+def create_ssl_context(verify=True, cert=None):
+    """Return an SSL context with the CA bundle and client cert loaded.
+
+    verify and cert take the same values as on a requests Session.
+    """
+    context = create_urllib3_context()
+    if verify is True:
+        context.load_verify_locations(requests.utils.DEFAULT_CA_BUNDLE_PATH)
+    elif os.path.isdir(verify):
+        context.load_verify_locations(capath=verify)
+    else:
+        context.load_verify_locations(cafile=verify)
+    if cert:
+        certfile, keyfile = cert if isinstance(cert, tuple) else (cert, None)
+        context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def _cache_key(method, url, body=None):
+    key = f"{method} {url}"
+    if body:
+        key += " " + hashlib.sha256(body).hexdigest()
+    return key
+
+
+def _cached_response(entry, response):
+    """Return a copy of a cached response for a 304 response."""
+    cached = requests.Response()
+    cached.status_code = 200
+    cached.reason = "OK"
+    cached._content = base64.b64decode(entry["body"])
+    if entry.get("content_type"):
+        cached.headers["Content-Type"] = entry["content_type"]
+    cached.encoding = requests.utils.get_encoding_from_headers(cached.headers)
+    cached.url = response.url
+    cached.request = response.request
+    cached.elapsed = response.elapsed
+    cached.from_cache = True
+    return cached
+
+
+def _body_size(data):
+    if data is None:
+        return 0
+    if isinstance(data, dict):
+        # Form values needn't be strings; size them as requests encodes
+        # them, leaving out None values.
+        fields = {k: v for k, v in data.items() if v is not None}
+        return len(urllib.parse.urlencode(fields, doseq=True))
+    return len(data)
+
+
+def _cap_timeout(timeout, deadline, what):
+    """Return timeout cut down to the time left before deadline.
+
+    raises: requests.exceptions.Timeout if the deadline has passed.
+    """
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise requests.exceptions.Timeout(f"Deadline passed before {what} was sent")
+    return tuple(min(t, remaining) for t in timeout)
+
+
+def _too_late(deadline, delay):
+    """Return whether a retry after delay would start past deadline."""
+    return deadline is not None and time.monotonic() + delay >= deadline
+
+
+def _parse_retry_after(value):
+    """Return seconds from a Retry-After header value, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def _encode_json(data):
+    # Bytes are taken to be JSON already.
+    return data if isinstance(data, bytes) else json_dumps(data)
+
+
 def get_sal_client(with_client_class=None):
     global _client_instance
     if _client_instance is None or (
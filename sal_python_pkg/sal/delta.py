@@ -0,0 +1,304 @@
+"""Delta and heartbeat checkins.
+
+A delta report carries only the sections, managed items and facts that
+have changed since the last report the server acknowledged, plus a
+digest of the full report so the server can check that applying the
+delta got it to the same place. A server which can't (or won't) apply
+a delta answers with anything but HTTP 200, and the client falls back
+to sending the full report.
+
+A heartbeat carries no report at all, only a digest of the report with
+its volatile fields (timestamps which change every run) left out. The
+client sends one when that digest matches the last report the server
+acknowledged, and the server answers HTTP 200 if it agrees.
+"""
+
+
+import collections
+import datetime
+import hashlib
+import platform
+import pathlib
+
+from sal.utils import atomic_write, json_dumps, read_json
+
+
+CHECKIN_STATE_PATH = {"Darwin": "/usr/local/sal/checkin_state.json"}.get(
+    platform.system()
+)
+DELTA_VERSION = 2
+# Section keys that are diffed item by item. Everything else in a
+# section is sent whole if any of it has changed.
+ITEMIZED_KEYS = ("managed_items", "facts")
+HEARTBEAT_VERSION = 1
+# Fields which change on every run even when nothing else has: keys of
+# each managed item, and facts of any section. Heartbeats ignore them,
+# and deltas send the managed items' ones separately (see
+# _volatile_values) so that they don't make every item look changed.
+VOLATILE_ITEM_KEYS = ("date_managed",)
+VOLATILE_FACTS = ("StartTime", "EndTime", "last_run_metrics")
+
+
+def canonical_json(data):
+    """Return data as compact, key-sorted JSON bytes."""
+    return json_dumps(data, sort_keys=True)
+
+
+def digest(data):
+    """Return the sha256 hex digest of data's canonical JSON."""
+    return hashlib.sha256(canonical_json(data)).hexdigest()
+
+
+def normalize(report):
+    """Return a copy of report without its volatile fields."""
+    normalized = {}
+    for name, section in report.items():
+        if not isinstance(section, dict):
+            normalized[name] = section
+            continue
+        section = dict(section)
+        if isinstance(section.get("facts"), dict):
+            section["facts"] = {
+                k: v for k, v in section["facts"].items() if k not in VOLATILE_FACTS
+            }
+        if isinstance(section.get("managed_items"), dict):
+            section["managed_items"] = {
+                item_name: _stable_item(item)
+                for item_name, item in section["managed_items"].items()
+            }
+        normalized[name] = section
+    return normalized
+
+
+def heartbeat_digest(report):
+    """Return the digest of report with its volatile fields left out."""
+    return digest(normalize(report))
+
+
+def build_heartbeat(report, state, interval):
+    """Return a heartbeat for report, or None if a report is needed.
+
+    A report is needed if there's no saved state, the report has
+    changed (volatile fields aside) since the state was saved, or the
+    last full report was at least interval seconds ago.
+    """
+    if not interval or not state.get("heartbeat_digest") or not state.get("timestamp"):
+        return None
+    last_report = datetime.datetime.fromisoformat(state["timestamp"])
+    age = datetime.datetime.now(datetime.timezone.utc) - last_report
+    if age.total_seconds() >= interval:
+        return None
+    heartbeat = heartbeat_digest(report)
+    if heartbeat != state["heartbeat_digest"]:
+        return None
+    return {
+        "heartbeat": HEARTBEAT_VERSION,
+        "serial": report.get("Machine", {}).get("extra_data", {}).get("serial"),
+        "key": report.get("Sal", {}).get("extra_data", {}).get("key"),
+        "digest": heartbeat,
+    }
+
+
+def report_index(report):
+    """Return per-section and per-item digests for report."""
+    index = {}
+    for name, section in report.items():
+        if not isinstance(section, dict):
+            index[name] = digest(section)
+            continue
+        entry = {"other": digest(_other_values(section))}
+        for key in ITEMIZED_KEYS:
+            if isinstance(section.get(key), dict):
+                # Managed items are compared without their volatile keys,
+                # whose values are compared all together.
+                stable = _stable_item if key == "managed_items" else lambda v: v
+                entry[key] = {k: digest(stable(v)) for k, v in section[key].items()}
+        if isinstance(section.get("managed_items"), dict):
+            entry["volatile"] = digest(_volatile_values(section["managed_items"]))
+        index[name] = entry
+    return index
+
+
+def build_delta(report, state):
+    """Return a delta of report against a saved checkin state.
+
+    Returns None if there is no state to build a delta from.
+    """
+    if not state.get("digest") or not state.get("index"):
+        return None
+
+    old_index = state["index"]
+    new_index = report_index(report)
+    sections = {}
+    for name, entry in new_index.items():
+        old_entry = old_index.get(name)
+        section = report[name]
+        if not isinstance(entry, dict) or not isinstance(old_entry, dict):
+            if entry != old_entry:
+                sections[name] = {"replace": section}
+            continue
+
+        changes = {}
+        if entry["other"] != old_entry.get("other"):
+            changes["values"] = _other_values(section)
+        for key in ITEMIZED_KEYS:
+            new_items = entry.get(key, {})
+            old_items = old_entry.get(key, {})
+            changed = {
+                k: section[key][k]
+                for k, v in new_items.items()
+                if old_items.get(k) != v
+            }
+            removed = [k for k in old_items if k not in new_items]
+            if changed or removed:
+                changes[key] = {"changed": changed, "removed": removed}
+        if "volatile" in entry and entry["volatile"] != old_entry.get("volatile"):
+            changes["volatile"] = _volatile_values(section["managed_items"])
+        if changes:
+            sections[name] = changes
+
+    return {
+        "delta": DELTA_VERSION,
+        "serial": report.get("Machine", {}).get("extra_data", {}).get("serial"),
+        "key": report.get("Sal", {}).get("extra_data", {}).get("key"),
+        "base_digest": state["digest"],
+        "digest": digest(report),
+        "sections": sections,
+        "removed_sections": [n for n in old_index if n not in new_index],
+    }
+
+
+def apply_delta(report, delta):
+    """Apply a delta built by `build_delta` to report, in place.
+
+    This is the server's half of the exchange; it lives here so that
+    the stand-in server and the client share one definition of the
+    format.
+
+    Raises ValueError if report isn't the one the delta was built
+    against, or the result doesn't match the delta's digest.
+    """
+    if delta.get("delta") != DELTA_VERSION:
+        raise ValueError(f"Unsupported delta version {delta.get('delta')}")
+    if digest(report) != delta["base_digest"]:
+        raise ValueError("Delta base does not match the stored report")
+
+    for name in delta.get("removed_sections", []):
+        report.pop(name, None)
+    for name, changes in delta.get("sections", {}).items():
+        if "replace" in changes:
+            report[name] = changes["replace"]
+            continue
+        section = report.setdefault(name, {})
+        if "values" in changes:
+            itemized = {
+                k: v for k, v in section.items() if k not in _other_values(section)
+            }
+            section.clear()
+            section.update(changes["values"])
+            section.update(itemized)
+        for key in ITEMIZED_KEYS:
+            if key in changes:
+                items = section.setdefault(key, {})
+                for item in changes[key]["removed"]:
+                    items.pop(item, None)
+                items.update(changes[key]["changed"])
+        if "volatile" in changes:
+            _apply_volatile_values(
+                section.setdefault("managed_items", {}), changes["volatile"]
+            )
+
+    if digest(report) != delta["digest"]:
+        raise ValueError("Report digest does not match after applying delta")
+    return report
+
+
+def _stable_item(item):
+    """Return a managed item without its volatile keys."""
+    if not isinstance(item, dict):
+        return item
+    return {k: v for k, v in item.items() if k not in VOLATILE_ITEM_KEYS}
+
+
+def _volatile_values(items):
+    """Return the volatile keys' values for all managed items, compactly.
+
+    For each key, the most common value is sent once as the default,
+    with only the items whose value differs (or which don't have the
+    key) listed: {key: {"default": value, "items": {name: value},
+    "absent": [name, ...]}}. Keys no item has are left out.
+    """
+    values = {}
+    for key in VOLATILE_ITEM_KEYS:
+        present = {}
+        absent = []
+        for name, item in items.items():
+            if not isinstance(item, dict):
+                continue
+            if key in item:
+                present[name] = item[key]
+            else:
+                absent.append(name)
+        if not present:
+            continue
+        encoded = {name: canonical_json(value) for name, value in present.items()}
+        common = collections.Counter(encoded.values()).most_common(1)[0][0]
+        default = next(present[n] for n, e in encoded.items() if e == common)
+        values[key] = {
+            "default": default,
+            "items": {n: present[n] for n, e in encoded.items() if e != common},
+            "absent": sorted(absent),
+        }
+    return values
+
+
+def _apply_volatile_values(items, values):
+    """Set the volatile keys of items as given by `_volatile_values`."""
+    for key in VOLATILE_ITEM_KEYS:
+        spec = values.get(key)
+        absent = set(spec["absent"]) if spec else None
+        for name, item in items.items():
+            if not isinstance(item, dict):
+                continue
+            if spec is None or name in absent:
+                item.pop(key, None)
+            else:
+                item[key] = spec["items"].get(name, spec["default"])
+
+
+def _other_values(section):
+    return {
+        k: v
+        for k, v in section.items()
+        if k not in ITEMIZED_KEYS or not isinstance(v, dict)
+    }
+
+
+class CheckinState:
+    """Digests of the last report the server acknowledged."""
+
+    def __init__(self, path=None):
+        self.path = pathlib.Path(path or CHECKIN_STATE_PATH)
+
+    def load(self):
+        return read_json(self.path)
+
+    def save(self, report):
+        state = {
+            "digest": digest(report),
+            "heartbeat_digest": heartbeat_digest(report),
+            "index": report_index(report),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        atomic_write(self.path, json_dumps(state))
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+
+    def delta(self, report):
+        """Return a delta of report against the saved state, or None."""
+        return build_delta(report, self.load())
+
+    def heartbeat(self, report, interval):
+        """Return a heartbeat to send instead of report, or None."""
+        return build_heartbeat(report, self.load(), interval)
@@ -1,2 +1,9 @@
+import requests.exceptions
+
+
 class SalClientError(Exception):
     pass
+
+
+class CircuitOpenError(SalClientError, requests.exceptions.ConnectionError):
+    """A request was not sent because the server appears to be down."""
@@ -1,18 +1,11 @@
-import binascii
+import atexit
 import datetime
 import logging
 import os
-import pathlib
 import subprocess
 import time
 
 from Foundation import (
-    kCFPreferencesAnyUser,
-    kCFPreferencesCurrentHost,
-    CFPreferencesSetValue,
-    CFPreferencesAppSynchronize,
-    CFPreferencesCopyAppValue,
-    CFPreferencesAppValueIsForced,
     NSDate,
     NSArray,
     NSDictionary,
@@ -20,14 +13,31 @@ from Foundation import (
     NSNull,
 )
 
-from sal.client import get_sal_client, MacKeychainClient
+from sal.prefs import sal_pref, set_sal_pref
+from sal.utils import (
+    UNOBJCTIFY_LEAF,
+    UNOBJCTIFY_MAPPING,
+    UNOBJCTIFY_SEQUENCE,
+    _convert_nsdata,
+    _convert_nsdate,
+    register_unobjctify_handler,
+    unobjctify,
+)
 
 
-BUNDLE_ID = "com.github.salopensource.sal"
 ISO_TIME_FORMAT = "%Y-%m-%d %H:%M:%S %z"
 
 
 def setup_sal_client():
+    # Imported here so that only scripts which talk to the server pay
+    # for importing requests.
+    from sal.client import (
+        get_sal_client,
+        MacKeychainClient,
+        ResponseCache,
+        RetryPolicy,
+    )
+
     ca_cert = sal_pref("CACert", "")
     cert = sal_pref("SSLClientCertificate", "")
     key = sal_pref("SSLClientKey", "")
@@ -63,149 +73,59 @@ def setup_sal_client():
         client.auth = ("sal", key)
 
     client.base_url = sal_pref("ServerURL")
+    client.compression = sal_pref("RequestCompression")
+    _restore_compression_rejection(client)
+    client.retry_policy = RetryPolicy(
+        attempts=sal_pref("RetryAttempts", 3), backoff=sal_pref("RetryBackoff", 1.0)
+    )
+    client.circuit_breaker.threshold = sal_pref("CircuitBreakerThreshold", 2)
+    if endpoint_timeouts := sal_pref("EndpointTimeouts"):
+        client.endpoint_timeouts = {k: tuple(v) for k, v in endpoint_timeouts.items()}
+    if sal_pref("CacheResponses", True):
+        client.response_cache = ResponseCache()
 
 
-def mac_pref(domain, key, default=None):
-    val = CFPreferencesCopyAppValue(key, domain)
-    return val if val is not None else default
-
-
-def set_sal_pref(pref_name, pref_value):
-    """Sets a Sal preference.
-
-    The preference file on disk is located at
-    /Library/Preferences/com.github.salopensource.sal.plist.  This should
-    normally be used only for 'bookkeeping' values; values that control
-    the behavior of munki may be overridden elsewhere (by MCX, for
-    example)
-    """
-    try:
-        CFPreferencesSetValue(
-            pref_name,
-            pref_value,
-            BUNDLE_ID,
-            kCFPreferencesAnyUser,
-            kCFPreferencesCurrentHost,
-        )
-        CFPreferencesAppSynchronize(BUNDLE_ID)
-    except Exception:
-        pass
-
-
-def sal_pref(pref_name, default=None):
-    """Return a preference value.
-
-    Since this uses CFPreferencesCopyAppValue, Preferences can be defined
-    several places. Precedence is:
-        - MCX
-        - /var/root/Library/Preferences/com.github.salopensource.sal.plist
-        - /Library/Preferences/com.github.salopensource.sal.plist
-        - default_prefs defined here.
+def _restore_compression_rejection(client):
+    """Keep the server's rejection of compressed bodies across runs.
 
-    Returned values are all converted to native python types through the
-    `unobjctify` function; e.g. dates are returned as aware-datetimes,
-    NSDictionary to dict, etc.
+    A 415 is remembered in the CompressionRejected pref, with the server
+    it came from and when compression is to be tried again, so that
+    later runs don't send a compressed body first. The pref is written
+    at exit if this run's client got a new 415.
     """
-    default_prefs = {
-        "ServerURL": "http://sal",
-        "osquery_launchd": "com.facebook.osqueryd.plist",
-        "SkipFacts": [],
-        "SyncScripts": True,
-        "BasicAuth": True,
-        "GetGrains": False,
-        "GetOhai": False,
-        "LastRunWasOffline": False,
-        "SendOfflineReport": False,
-    }
-
-    pref_value = mac_pref(BUNDLE_ID, pref_name, default)
-    if pref_value is None and pref_name in default_prefs:
-        # If we got here, the pref value was either set to None or never
-        # set, AND the default was also None. Fall back to auto prefs.
-        pref_value = default_prefs.get(pref_name)
-        # we're using a default value. We'll write it out to
-        # /Library/Preferences/<BUNDLE_ID>.plist for admin
-        # discoverability
-        set_sal_pref(pref_name, pref_value)
-
-    return unobjctify(pref_value)
-
-
-def forced(pref, bundle_identifier=BUNDLE_ID):
-    return CFPreferencesAppValueIsForced(pref, bundle_identifier)
-
-
-def prefs_report():
-    prefs = (
-        "ServerURL",
-        "key",
-        "BasicAuth",
-        "SyncScripts",
-        "SkipFacts",
-        "CACert",
-        "SendOfflineReport",
-        "SSLClientCertificate",
-        "SSLClientKey",
-        "MessageBlacklistPatterns",
+    client.compression_retry_interval = (
+        sal_pref("CompressionRetryDays", 7) * 24 * 60 * 60
     )
-    return {k: {"value": sal_pref(k), "forced": forced(k)} for k in prefs}
-
-
-def unobjctify(element, safe=False):
-    """Recursively convert nested elements to native python datatypes.
-
-    Types accepted include str, bytes, int, float, bool, None, list,
-    dict, set, tuple, NSArray, NSDictionary, NSData, NSDate, NSNull.
-
-    element: Some (potentially) nested data you want to convert.
+    rejected = sal_pref("CompressionRejected") or {}
+    until = rejected.get("Until")
+    if until and rejected.get("ServerURL") == client.base_url:
+        if until.tzinfo is None:
+            until = until.replace(tzinfo=datetime.timezone.utc)
+        client.compression_rejected_until = until.timestamp()
+    restored = client.compression_rejected_until
+
+    def save():
+        if client.compression_rejected_until == restored:
+            return
+        until = datetime.datetime.fromtimestamp(
+            client.compression_rejected_until, datetime.timezone.utc
+        )
+        set_sal_pref(
+            "CompressionRejected", {"ServerURL": client.base_url, "Until": until}
+        )
 
-    safe: Bool (defaults to False) whether you want printable
-        representations instead of the python equivalent. e.g.  NSDate
-        safe=True becomes a str, safe=False becomes a datetime.datetime.
-        NSData safe=True bcomes a hex str, safe=False becomes bytes. Any
-        type not explicitly handled by this module will raise an
-        exception unless safe=True, where it will instead replace the
-        data with a str of '<UNSUPPORTED TYPE>'
+    atexit.register(save)
 
-        This is primarily for safety in serialization to plists or
-        output.
 
-    returns: Python equivalent of the original input.
-        e.g. NSArray -> List, NSDictionary -> Dict, etc.
-
-    raises: ValueError for any data that isn't supported (yet!) by this
-        function.
-    """
-    supported_types = (str, bytes, int, float, bool, datetime.datetime)
-    if isinstance(element, supported_types):
-        return element
-    elif isinstance(element, (dict, NSDictionary)):
-        return {k: unobjctify(v, safe=safe) for k, v in element.items()}
-    elif isinstance(element, (list, NSArray)):
-        return [unobjctify(i, safe=safe) for i in element]
-    elif isinstance(element, set):
-        return {unobjctify(i, safe=safe) for i in element}
-    elif isinstance(element, tuple):
-        return tuple([unobjctify(i, safe=safe) for i in element])
-    elif isinstance(element, NSData):
-        return binascii.hexlify(element) if safe else bytes(element)
-    elif isinstance(element, NSDate):
-        return (
-            str(element)
-            if safe
-            else datetime.datetime.strptime(element.description(), ISO_TIME_FORMAT)
-        )
-    elif isinstance(element, NSNull) or element is None:
-        return "" if safe else None
-    elif safe:
-        return "<UNSUPPORTED TYPE>"
-    raise ValueError(f"Element type '{type(element)}' is not supported!")
+def _convert_nsnull(element, safe):
+    return "" if safe else None
 
 
 def script_is_running(scriptname):
-    """Returns Process ID for a running python script.
+    """Returns whether another process is running the python script.
 
-    Not at all stolen from Munki. Honest.
+    Not at all stolen from Munki. Honest. Sal's own scripts use a
+    `LockFile` instead; this is for scripts which don't, like Munki's.
     """
     cmd = ["/bin/ps", "-eo", "pid=,command="]
     proc = subprocess.Popen(
@@ -225,7 +145,7 @@ def script_is_running(scriptname):
                 # first look for Python processes
                 if "MacOS/Python" in args[0] or "python" in args[0]:
                     # look for first argument being scriptname
-                    if scriptname in args[1]:
+                    if os.path.basename(args[1]) == scriptname:
                         try:
                             if int(pid) != mypid:
                                 return True
@@ -240,31 +160,6 @@ def script_is_running(scriptname):
     return False
 
 
-def run_scripts(dir_path, cli_args=None, error=False):
-    results = []
-    skip_names = {"__pycache__"}
-    scripts = (p for p in pathlib.Path(dir_path).iterdir() if p.name not in skip_names)
-    for script in scripts:
-        if not os.access(script, os.X_OK):
-            results.append(f"'{script}' is not executable or has bad permissions")
-            continue
-
-        cmd = [script]
-        if cli_args:
-            cmd.append(cli_args)
-        try:
-            subprocess.check_call(cmd)
-            results.append(f"'{script}' ran successfully")
-        except (OSError, subprocess.CalledProcessError):
-            errormsg = f"'{script}' had errors during execution!"
-            if not error:
-                results.append(errormsg)
-            else:
-                raise RuntimeError(errormsg)
-
-    return results
-
-
 def wait_for_script(scriptname, repeat=3, pause=1):
     """Tries a few times to wait for a script to finish."""
     count = 0
@@ -275,3 +170,10 @@ def wait_for_script(scriptname, repeat=3, pause=1):
         else:
             return False
     return True
+
+
+register_unobjctify_handler(NSDictionary, UNOBJCTIFY_MAPPING)
+register_unobjctify_handler(NSArray, UNOBJCTIFY_SEQUENCE)
+register_unobjctify_handler(NSData, UNOBJCTIFY_LEAF, _convert_nsdata)
+register_unobjctify_handler(NSDate, UNOBJCTIFY_LEAF, _convert_nsdate)
+register_unobjctify_handler(NSNull, UNOBJCTIFY_LEAF, _convert_nsnull)
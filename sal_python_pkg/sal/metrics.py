@@ -0,0 +1,154 @@
+"""Per-request network metrics for SalClient."""
+
+
+import dataclasses
+import datetime
+import platform
+import threading
+import time
+from typing import Optional
+
+from sal.utils import atomic_write, json_dumps
+
+
+LAST_RUN_METRICS_PATH = {"Darwin": "/usr/local/sal/last_run_metrics.json"}.get(
+    platform.system()
+)
+
+# Connection timings for the request in progress on each thread; the
+# timed connection classes in sal.client fill this in when a request
+# has to open a new connection.
+connection_timings = threading.local()
+
+
+@dataclasses.dataclass
+class RequestMetrics:
+    """What one request through SalClient cost.
+
+    Times are in seconds. dns, connect and tls are None when the
+    request reused an open connection (or its session doesn't time
+    connections), and are for the last connection opened if there
+    were several, e.g. because of retries; connections counts them all.
+    request_bytes is the body as sent; raw_request_bytes is its size
+    before compression.
+    """
+
+    endpoint: str
+    method: str
+    status: Optional[int] = None
+    error: Optional[str] = None
+    attempts: int = 1
+    total: float = 0.0
+    dns: Optional[float] = None
+    connect: Optional[float] = None
+    tls: Optional[float] = None
+    connections: int = 0
+    request_bytes: int = 0
+    raw_request_bytes: int = 0
+    response_bytes: int = 0
+    from_cache: bool = False
+
+    @property
+    def compression_ratio(self):
+        if not self.raw_request_bytes or self.raw_request_bytes == self.request_bytes:
+            return None
+        return round(self.request_bytes / self.raw_request_bytes, 3)
+
+    def to_dict(self):
+        data = dataclasses.asdict(self)
+        data["compression_ratio"] = self.compression_ratio
+        return data
+
+
+class NetworkMetrics:
+    """Collects RequestMetrics for a run and summarizes them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+
+    def record(self, metrics):
+        with self.lock:
+            self.requests.append(metrics)
+
+    def summary(self):
+        """Return totals for the run, overall and per endpoint.
+
+        Endpoints are grouped by their first two path segments, so that
+        e.g. every inventory/hash/<serial>/ request counts together.
+        """
+        with self.lock:
+            requests = list(self.requests)
+        endpoints = {}
+        for request in requests:
+            group = "/".join(request.endpoint.split("/")[:2])
+            entry = endpoints.setdefault(
+                group,
+                {
+                    "requests": 0,
+                    "errors": 0,
+                    "connections": 0,
+                    "cached": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "request_bytes": 0,
+                    "response_bytes": 0,
+                },
+            )
+            entry["requests"] += 1
+            entry["errors"] += bool(request.error or (request.status or 0) >= 400)
+            entry["connections"] += request.connections
+            entry["cached"] += request.from_cache
+            entry["total"] += request.total
+            entry["max"] = max(entry["max"], request.total)
+            entry["request_bytes"] += request.request_bytes
+            entry["response_bytes"] += request.response_bytes
+        for entry in endpoints.values():
+            entry["total"] = round(entry["total"], 3)
+            entry["max"] = round(entry["max"], 3)
+
+        return {
+            "started": self.started,
+            "finished": datetime.datetime.now(datetime.timezone.utc),
+            "requests": len(requests),
+            "errors": sum(e["errors"] for e in endpoints.values()),
+            "connections": sum(e["connections"] for e in endpoints.values()),
+            "total": round(sum(r.total for r in requests), 3),
+            "request_bytes": sum(r.request_bytes for r in requests),
+            "response_bytes": sum(r.response_bytes for r in requests),
+            "endpoints": endpoints,
+        }
+
+    def save(self, path=None):
+        """Write the summary and every request's metrics as JSON."""
+        report = self.summary()
+        with self.lock:
+            report["details"] = [r.to_dict() for r in self.requests]
+        atomic_write(path or LAST_RUN_METRICS_PATH, json_dumps(report, indent=2))
+
+
+def start_connection_timing():
+    """Clear the connection timings for a request on this thread."""
+    connection_timings.current = {}
+
+
+def finish_connection_timing():
+    """Return (and clear) the connection timings for this thread."""
+    timings = getattr(connection_timings, "current", None) or {}
+    connection_timings.current = None
+    return timings
+
+
+def count(name):
+    """Add one to the count under name for this thread."""
+    timings = getattr(connection_timings, "current", None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0) + 1
+
+
+def timed(name, start):
+    """Record the seconds since start under name for this thread."""
+    timings = getattr(connection_timings, "current", None)
+    if timings is not None:
+        timings[name] = round(time.perf_counter() - start, 6)
@@ -0,0 +1,307 @@
+"""Sal and Munki preferences.
+
+Preferences are read through a `PrefsSnapshot`, which loads each domain
+once per run and answers every later lookup from memory. Values written
+back for admin discoverability when a default applies are batched and
+flushed once, at exit (or on `flush()`).
+
+Where the values come from is up to the snapshot's backend:
+`CFPreferencesBackend` on macOS, or `PlistBackend` to read plain plist
+files from a directory, e.g. for tests and benchmarks on Linux:
+
+    sal.set_prefs_snapshot(sal.PrefsSnapshot(sal.PlistBackend("/tmp/prefs")))
+"""
+
+
+import atexit
+import logging
+import pathlib
+import plistlib
+import threading
+
+from sal.utils import atomic_write
+
+
+BUNDLE_ID = "com.github.salopensource.sal"
+MUNKI_BUNDLE_ID = "ManagedInstalls"
+DEFAULT_PREFS = {
+    "ServerURL": "http://sal",
+    "osquery_launchd": "com.facebook.osqueryd.plist",
+    "SkipFacts": [],
+    "SyncScripts": True,
+    "BasicAuth": True,
+    "GetGrains": False,
+    "GetOhai": False,
+    "LastRunWasOffline": False,
+    "SendOfflineReport": False,
+}
+REPORTED_PREFS = (
+    "ServerURL",
+    "key",
+    "BasicAuth",
+    "SyncScripts",
+    "SkipFacts",
+    "CACert",
+    "SendOfflineReport",
+    "SSLClientCertificate",
+    "SSLClientKey",
+    "MessageBlacklistPatterns",
+)
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+class CFPreferencesBackend:
+    """Preferences through CFPreferences, with macOS's precedence.
+
+    Values are converted to native python types with `unobjctify`.
+    """
+
+    # Whether read() returns every key that has a value.
+    lists_all_keys = False
+
+    # Scopes whose keys are listed up front. Keys only set by profiles
+    # aren't listed, so those are looked up one by one on first use.
+    SCOPES = (
+        ("kCFPreferencesAnyUser", "kCFPreferencesCurrentHost"),
+        ("kCFPreferencesAnyUser", "kCFPreferencesAnyHost"),
+        ("kCFPreferencesCurrentUser", "kCFPreferencesAnyHost"),
+    )
+
+    def __init__(self):
+        # Imported here so that the rest of the module works off macOS.
+        import Foundation
+
+        from sal.mac_utils import unobjctify
+
+        self.foundation = Foundation
+        self.unobjctify = unobjctify
+
+    def read(self, domain, keys=()):
+        """Return every value set in domain, and the values of keys."""
+        keys = set(keys)
+        for user, host in self.SCOPES:
+            keys.update(
+                self.foundation.CFPreferencesCopyKeyList(
+                    domain,
+                    getattr(self.foundation, user),
+                    getattr(self.foundation, host),
+                )
+                or ()
+            )
+        return {key: self.get(domain, key) for key in keys}
+
+    def get(self, domain, key):
+        return self.unobjctify(self.foundation.CFPreferencesCopyAppValue(key, domain))
+
+    def refresh(self, domain, key):
+        """Return key's value as it is now, including other processes' writes."""
+        self.foundation.CFPreferencesAppSynchronize(domain)
+        return self.get(domain, key)
+
+    def forced(self, domain, key):
+        return bool(self.foundation.CFPreferencesAppValueIsForced(key, domain))
+
+    def write(self, domain, values):
+        for key, value in values.items():
+            self.foundation.CFPreferencesSetValue(
+                key,
+                value,
+                domain,
+                self.foundation.kCFPreferencesAnyUser,
+                self.foundation.kCFPreferencesCurrentHost,
+            )
+        self.foundation.CFPreferencesAppSynchronize(domain)
+
+
+class PlistBackend:
+    """Preferences from `<directory>/<domain>.plist`.
+
+    Values in `<directory>/managed/<domain>.plist` take precedence and
+    are reported as forced, like those from a configuration profile.
+    """
+
+    lists_all_keys = True
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+
+    def _load(self, path):
+        try:
+            return plistlib.loads(path.read_bytes())
+        except (FileNotFoundError, plistlib.InvalidFileException):
+            return {}
+
+    def read(self, domain, keys=()):
+        values = self._load(self.directory / f"{domain}.plist")
+        values.update(self._load(self.directory / "managed" / f"{domain}.plist"))
+        return values
+
+    def get(self, domain, key):
+        return self.read(domain).get(key)
+
+    def refresh(self, domain, key):
+        return self.get(domain, key)
+
+    def forced(self, domain, key):
+        return key in self._load(self.directory / "managed" / f"{domain}.plist")
+
+    def write(self, domain, values):
+        path = self.directory / f"{domain}.plist"
+        current = self._load(path)
+        current.update(values)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(path, plistlib.dumps(current))
+
+
+class PrefsSnapshot:
+    """Preference values read once, with writes batched.
+
+    A domain is read from the backend in one go the first time one of
+    its prefs is looked up; keys the backend didn't list are looked up
+    individually once (unless it lists all keys), and remembered even if
+    unset. Writes update the snapshot straight away and reach the backend
+    on `flush()`, which is registered to run at exit.
+
+    Bookkeeping values other processes may write while this one runs
+    (e.g. LastCheckDate) should be re-read with `refresh()`.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or CFPreferencesBackend()
+        self.lock = threading.RLock()
+        self.values = {}
+        self.forced_values = {}
+        self.pending = {}
+        self._flush_registered = False
+
+    def get(self, domain, key, default=None):
+        with self.lock:
+            if domain not in self.values:
+                known = DEFAULT_PREFS.keys() | set(REPORTED_PREFS)
+                keys = known if domain == BUNDLE_ID else ()
+                self.values[domain] = self.backend.read(domain, keys)
+            values = self.values[domain]
+            if key not in values and not self.backend.lists_all_keys:
+                values[key] = self.backend.get(domain, key)
+            value = values.get(key)
+        return value if value is not None else default
+
+    def refresh(self, domain, key, default=None):
+        """Re-read key from the backend, and return its value.
+
+        A value set here but not yet flushed is kept.
+        """
+        with self.lock:
+            self.get(domain, key)
+            if key not in self.pending.get(domain, {}):
+                self.values[domain][key] = self.backend.refresh(domain, key)
+        return self.get(domain, key, default)
+
+    def set(self, domain, key, value):
+        """Set a value, to be written by the next flush."""
+        with self.lock:
+            self.get(domain, key)
+            self.values[domain][key] = value
+            self.pending.setdefault(domain, {})[key] = value
+            if not self._flush_registered:
+                atexit.register(self.flush)
+                self._flush_registered = True
+
+    def forced(self, domain, key):
+        with self.lock:
+            if (domain, key) not in self.forced_values:
+                self.forced_values[domain, key] = self.backend.forced(domain, key)
+            return self.forced_values[domain, key]
+
+    def flush(self):
+        """Write all pending values, one batch per domain."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for domain, values in pending.items():
+            try:
+                self.backend.write(domain, values)
+            except Exception as error:
+                logging.debug("Failed to write prefs to %s: %s", domain, error)
+
+
+def prefs_snapshot():
+    """Return this run's PrefsSnapshot, creating it on first use."""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = PrefsSnapshot()
+        return _snapshot
+
+
+def set_prefs_snapshot(snapshot):
+    """Use snapshot for all later preference lookups (None to reset)."""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = snapshot
+
+
+def mac_pref(domain, key, default=None):
+    return prefs_snapshot().get(domain, key, default)
+
+
+def munki_pref(key, default=None):
+    return mac_pref(MUNKI_BUNDLE_ID, key, default)
+
+
+def set_sal_pref(pref_name, pref_value):
+    """Sets a Sal preference.
+
+    The preference file on disk is located at
+    /Library/Preferences/com.github.salopensource.sal.plist.  This should
+    normally be used only for 'bookkeeping' values; values that control
+    the behavior of munki may be overridden elsewhere (by MCX, for
+    example)
+    """
+    snapshot = prefs_snapshot()
+    snapshot.set(BUNDLE_ID, pref_name, pref_value)
+    snapshot.flush()
+
+
+def sal_pref(pref_name, default=None):
+    """Return a preference value.
+
+    Since on macOS this uses CFPreferencesCopyAppValue, Preferences can
+    be defined several places. Precedence is:
+        - MCX
+        - /var/root/Library/Preferences/com.github.salopensource.sal.plist
+        - /Library/Preferences/com.github.salopensource.sal.plist
+        - DEFAULT_PREFS defined here.
+
+    Returned values are all native python types; e.g. dates are returned
+    as aware-datetimes, NSDictionary as dict, etc.
+    """
+    pref_value = mac_pref(BUNDLE_ID, pref_name, default)
+    if pref_value is None and pref_name in DEFAULT_PREFS:
+        # If we got here, the pref value was either set to None or never
+        # set, AND the default was also None. Fall back to auto prefs.
+        pref_value = DEFAULT_PREFS.get(pref_name)
+        # we're using a default value. We'll write it out to
+        # /Library/Preferences/<BUNDLE_ID>.plist for admin
+        # discoverability, along with any others, at exit.
+        prefs_snapshot().set(BUNDLE_ID, pref_name, pref_value)
+
+    return pref_value
+
+
+def refresh_sal_pref(pref_name, default=None):
+    """Return a Sal preference re-read from disk, not from the snapshot.
+
+    For bookkeeping values another process may have written since this
+    one started, like LastCheckDate.
+    """
+    return prefs_snapshot().refresh(BUNDLE_ID, pref_name, default)
+
+
+def forced(pref, bundle_identifier=BUNDLE_ID):
+    return prefs_snapshot().forced(bundle_identifier, pref)
+
+
+def prefs_report():
+    return {k: {"value": sal_pref(k), "forced": forced(k)} for k in REPORTED_PREFS}
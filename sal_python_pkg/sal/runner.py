@@ -0,0 +1,218 @@
+import concurrent.futures
+import dataclasses
+import importlib.util
+import logging
+import os
+import pathlib
+import re
+import signal
+import subprocess
+import time
+from typing import Optional
+
+
+SKIP_NAMES = {"__pycache__"}
+# Scripts may ask to be run after other scripts in the same directory
+# by including a comment like this near the top of the file:
+#   # sal-run-after: machine_checkin.py, sal_checkin
+RUN_AFTER_PATTERN = re.compile(rb"^#\s*sal-run-after:(.*)$", re.MULTILINE)
+RUN_AFTER_HEADER_SIZE = 2048
+# Python scripts that define main() behind a __main__ guard, like the
+# bundled checkin modules, can be imported and run in-process.
+MAIN_FUNC_PATTERN = re.compile(rb"^def main\(", re.MULTILINE)
+MAIN_GUARD_PATTERN = re.compile(rb"""^if __name__ == ["']__main__["']:""", re.MULTILINE)
+
+
+@dataclasses.dataclass
+class ScriptResult:
+    """The outcome of running one script with `run_scripts`."""
+
+    path: pathlib.Path
+    returncode: Optional[int] = None
+    duration: float = 0.0
+    timed_out: bool = False
+    skipped: bool = False
+    in_process: bool = False
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    @property
+    def message(self):
+        if self.skipped:
+            return f"'{self.path}' is not executable or has bad permissions"
+        elif self.timed_out:
+            return f"'{self.path}' timed out after {self.duration:.1f}s and was killed"
+        elif self.ok:
+            return f"'{self.path}' ran successfully in {self.duration:.2f}s"
+        return f"'{self.path}' had errors during execution!"
+
+    def __str__(self):
+        return self.message
+
+
+def run_scripts(
+    dir_path, cli_args=None, error=False, concurrency=1, timeout=None, in_process=False
+):
+    """Run all executables in dir_path.
+
+    Scripts are started in name order. With a concurrency greater than
+    one, up to that many scripts run at once; a script which declares
+    `sal-run-after` dependencies waits until those have finished.
+
+    dir_path: Directory of scripts to run.
+    cli_args: Optional single argument to pass to each script.
+    error: Bool (defaults to False) whether to stop starting scripts
+        and raise a RuntimeError once a script fails.
+    concurrency: Maximum number of scripts to run at once.
+    timeout: Seconds a script may run for before it (and any processes
+        it started) are killed. None or 0 for no limit.
+    in_process: Bool (defaults to False) whether to import Python
+        scripts that define a guarded main() and call it in this
+        interpreter rather than starting a new one for each. Any other
+        executable is still run as a subprocess. Exceptions raised by
+        a module are logged and reported as a failure of that script.
+        Scripts run in-process can't be interrupted, so this is
+        ignored (with a warning) when a timeout is set.
+
+    returns: List of ScriptResult, in name order.
+    """
+    scripts = sorted(
+        p for p in pathlib.Path(dir_path).iterdir() if p.name not in SKIP_NAMES
+    )
+    results = {}
+    pending = []
+    for script in scripts:
+        if os.access(script, os.X_OK):
+            pending.append(script)
+        else:
+            results[script] = ScriptResult(script, skipped=True)
+
+    if in_process and timeout:
+        logging.warning(
+            "Running scripts in %s as subprocesses, so that their %ss timeout "
+            "can be enforced.",
+            dir_path,
+            timeout,
+        )
+        in_process = False
+
+    dependencies = {s: _get_run_after(s, pending) for s in pending}
+    concurrency = max(1, int(concurrency or 1))
+    failure = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        running = {}
+        while pending or running:
+            if failure is None:
+                waiting_on = set(pending) | set(running.values())
+                ready = [s for s in pending if not dependencies[s] & waiting_on]
+                if not ready and not running:
+                    logging.warning(
+                        "Circular 'sal-run-after' dependencies in %s; ignoring them.",
+                        dir_path,
+                    )
+                    ready = pending
+                for script in ready[: concurrency - len(running)]:
+                    pending.remove(script)
+                    if in_process and _is_python_module(script):
+                        future = pool.submit(_run_module, script)
+                    else:
+                        future = pool.submit(_run_script, script, cli_args, timeout)
+                    running[future] = script
+
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                script = running.pop(future)
+                results[script] = future.result()
+                if error and failure is None and not results[script].ok:
+                    failure = results[script]
+
+    if failure is not None:
+        raise RuntimeError(failure.message)
+
+    return [results[s] for s in scripts if s in results]
+
+
+def _get_run_after(script, scripts):
+    """Return the set of scripts that script has asked to run after."""
+    try:
+        with open(script, "rb") as handle:
+            header = handle.read(RUN_AFTER_HEADER_SIZE)
+    except OSError:
+        return set()
+
+    names = set()
+    for match in RUN_AFTER_PATTERN.finditer(header):
+        names.update(
+            n.strip() for n in match.group(1).decode(errors="ignore").split(",")
+        )
+
+    dependencies = {
+        s for s in scripts if s != script and (s.name in names or s.stem in names)
+    }
+    found = {s.name for s in dependencies} | {s.stem for s in dependencies}
+    if unknown := names - found - {""}:
+        logging.debug("'%s' runs after unknown scripts: %s", script, ", ".join(unknown))
+    return dependencies
+
+
+def _run_script(script, cli_args=None, timeout=None):
+    cmd = [script]
+    if cli_args:
+        cmd.append(cli_args)
+
+    start = time.monotonic()
+    try:
+        # Give each script its own process group so that a timeout
+        # also takes out anything it has started.
+        proc = subprocess.Popen(cmd, start_new_session=True)
+    except OSError:
+        return ScriptResult(script, duration=time.monotonic() - start)
+
+    try:
+        returncode = proc.wait(timeout=timeout or None)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        proc.wait()
+        return ScriptResult(script, duration=time.monotonic() - start, timed_out=True)
+
+    return ScriptResult(script, returncode, time.monotonic() - start)
+
+
+def _is_python_module(script):
+    if script.suffix != ".py":
+        return False
+    try:
+        source = script.read_bytes()
+    except OSError:
+        return False
+    return bool(MAIN_FUNC_PATTERN.search(source) and MAIN_GUARD_PATTERN.search(source))
+
+
+def _run_module(script):
+    start = time.monotonic()
+    try:
+        spec = importlib.util.spec_from_file_location(f"_sal_run_{script.stem}", script)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.main()
+        returncode = 0
+    except SystemExit as exit_:
+        if exit_.code is None or isinstance(exit_.code, int):
+            returncode = exit_.code or 0
+        else:
+            logging.error("'%s' exited: %s", script, exit_.code)
+            returncode = 1
+    except Exception:
+        logging.exception("'%s' raised an exception", script)
+        returncode = 1
+
+    return ScriptResult(script, returncode, time.monotonic() - start, in_process=True)
@@ -0,0 +1,129 @@
+"""On-disk spool of checkin reports that could not be sent."""
+
+
+import datetime
+import gzip
+import logging
+import pathlib
+import platform
+import time
+import zlib
+
+from sal.utils import atomic_write, json_dumps, json_loads
+
+
+SPOOL_DIR = {"Darwin": "/usr/local/sal/spool"}.get(platform.system())
+SPOOL_SUFFIX = ".json.gz"
+
+
+class Spool:
+    """A directory of gzipped reports, replayed oldest first.
+
+    Each report is stored in its own file named for the time it was
+    spooled. Whenever a report is added, reports older than max_age are
+    dropped, and then the oldest reports are dropped until the spool
+    fits in max_bytes (of compressed data).
+    """
+
+    def __init__(
+        self,
+        path=None,
+        max_bytes=5 * 1024 * 1024,
+        max_age=datetime.timedelta(days=7),
+    ):
+        self.path = pathlib.Path(path or SPOOL_DIR)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def __len__(self):
+        return len(self.entries())
+
+    def entries(self):
+        """Return the spooled report files, oldest first."""
+        if not self.path.is_dir():
+            return []
+        return sorted(self.path.glob(f"*{SPOOL_SUFFIX}"))
+
+    def add(self, report):
+        self.path.mkdir(parents=True, exist_ok=True)
+        data = gzip.compress(json_dumps(report))
+        entry = self.path / f"{time.time_ns()}{SPOOL_SUFFIX}"
+        atomic_write(entry, data)
+        logging.info("Spooled report (%d bytes) to %s", len(data), entry)
+        self.prune()
+
+    def load(self, entry):
+        """Return the report in entry, or None if it can't be read."""
+        data = self.read(entry)
+        try:
+            return None if data is None else json_loads(data)
+        except ValueError:
+            logging.warning("Discarding unreadable spooled report %s", entry)
+            self.remove([entry])
+            return None
+
+    def read(self, entry):
+        """Return the report in entry as JSON bytes, or None if it can't be read."""
+        try:
+            return gzip.decompress(entry.read_bytes())
+        except (OSError, EOFError, zlib.error):
+            logging.warning("Discarding unreadable spooled report %s", entry)
+            self.remove([entry])
+            return None
+
+    def batches(self, max_reports=20, max_bytes=4 * 1024 * 1024):
+        """Yield (entries, body) for batches of spooled reports, oldest first.
+
+        body is the JSON for the checkin/batch endpoint, {"reports":
+        [{"spooled": <date>, "report": <report>}, ...]}, spliced together
+        from the spooled JSON without parsing it. A batch has at most
+        max_reports reports and max_bytes of body, though a report is
+        sent on its own however big it is. Reports are only read as the
+        batches are built, so stopping early reads no more of them.
+        """
+        entries, parts, size = [], [], 0
+        for entry in self.entries():
+            report = self.read(entry)
+            if report is None:
+                continue
+            spooled = json_dumps(self.spooled_at(entry))
+            part = b'{"spooled":' + spooled + b',"report":' + report + b"}"
+            if entries and (
+                len(entries) >= max_reports or size + len(part) > max_bytes
+            ):
+                yield entries, _batch_body(parts)
+                entries, parts, size = [], [], 0
+            entries.append(entry)
+            parts.append(part)
+            size += len(part) + 1
+        if entries:
+            yield entries, _batch_body(parts)
+
+    def spooled_at(self, entry):
+        """Return when entry was spooled as an aware datetime."""
+        seconds = int(entry.name[: -len(SPOOL_SUFFIX)]) / 1e9
+        return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+    def remove(self, entries):
+        for entry in entries:
+            entry.unlink(missing_ok=True)
+
+    def prune(self):
+        """Drop reports past max_age, then the oldest until under max_bytes."""
+        entries = self.entries()
+        if self.max_age:
+            cutoff = datetime.datetime.now(datetime.timezone.utc) - self.max_age
+            expired = [e for e in entries if self.spooled_at(e) < cutoff]
+            self.remove(expired)
+            entries = entries[len(expired) :]
+
+        sizes = [e.stat().st_size for e in entries]
+        # The newest report is always kept, however big it is.
+        while len(entries) > 1 and self.max_bytes and sum(sizes) > self.max_bytes:
+            logging.info("Spool is full; dropping %s", entries[0])
+            self.remove(entries[:1])
+            entries, sizes = entries[1:], sizes[1:]
+
+
+def _batch_body(parts):
+    return b'{"reports":[' + b",".join(parts) + b"]}"
@@ -2,25 +2,143 @@
 
 
 import base64
+import binascii
 import bz2
 import datetime
+import errno
+import fcntl
 import hashlib
 import json
+import logging
+import lzma
+import math
 import os
 import platform
 import pathlib
 import plistlib
+import stat
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 RESULTS_PATH = {"Darwin": "/usr/local/sal/checkin_results.json"}.get(platform.system())
+HASH_INDEX_PATH = {"Darwin": "/usr/local/sal/hash_index.json"}.get(platform.system())
+LOCK_DIR = {"Darwin": "/usr/local/sal"}.get(platform.system())
+HASH_CHUNK_SIZE = 1024 * 1024
+# Files modified more recently than this may still change again within
+# the same mtime tick, so their hashes aren't cached.
+HASH_INDEX_MIN_AGE_NS = 2 * 10**9
+SUBMISSION_CODECS = {
+    "bz2": lambda level: bz2.BZ2Compressor(9 if level is None else level),
+    "zlib": lambda level: zlib.compressobj(-1 if level is None else level),
+    "lzma": lambda level: lzma.LZMACompressor(preset=level),
+}
+if orjson is not None:
+    # Datetimes go through serializer, as they do with json.
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+# Multiple of 3 so that each chunk base64 encodes without padding.
+SUBMISSION_CHUNK_SIZE = 3 * 256 * 1024
+UNOBJCTIFY_LEAF = "leaf"
+UNOBJCTIFY_MAPPING = "mapping"
+UNOBJCTIFY_SEQUENCE = "sequence"
+# Handlers for unobjctify, by type; see register_unobjctify_handler.
+UNOBJCTIFY_HANDLERS = {}
+# Handlers found for each type seen, including subclasses.
+_unobjctify_resolved = {}
+
 
+def get_hash(file_path, index=None):
+    """Return sha256 hash of file_path.
+
+    If a HashIndex is passed, files that haven't changed since they were
+    last hashed are looked up in it rather than read again.
+    """
+    if index is not None:
+        return index.get_hash(file_path)
+    return _hash_file(file_path)
 
-def get_hash(file_path):
-    """Return sha256 hash of file_path."""
-    text = b""
+
+def _hash_file(file_path):
+    hasher = hashlib.sha256()
     if (path := pathlib.Path(file_path)).is_file():
-        text = path.read_bytes()
-    return hashlib.sha256(text).hexdigest()
+        with open(path, "rb") as handle:
+            for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class HashIndex:
+    """On-disk cache of file hashes.
+
+    Entries are keyed on path and are only used while the file's inode,
+    size and mtime are unchanged, so an unchanged file costs a `stat()`
+    rather than a full read. `hits` and `misses` count lookups served
+    from the index and files that had to be hashed.
+
+    An index may be shared between threads; files are hashed outside
+    its lock.
+    """
+
+    def __init__(self, path=None):
+        self.path = pathlib.Path(path or HASH_INDEX_PATH)
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self.dirty = False
+        self.lock = threading.RLock()
+
+    @property
+    def entries(self):
+        with self.lock:
+            if self._entries is None:
+                self._entries = read_json(self.path)
+            return self._entries
+
+    def get_hash(self, file_path):
+        key = os.path.abspath(file_path)
+        try:
+            file_stat = os.stat(key)
+        except OSError:
+            return _hash_file(key)
+        if not stat.S_ISREG(file_stat.st_mode):
+            return _hash_file(key)
+
+        signature = [file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns]
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[:3] == signature:
+                self.hits += 1
+                return entry[3]
+            self.misses += 1
+
+        file_hash = _hash_file(key)
+        with self.lock:
+            if time.time_ns() - file_stat.st_mtime_ns > HASH_INDEX_MIN_AGE_NS:
+                self.entries[key] = signature + [file_hash]
+                self.dirty = True
+            elif self.entries.pop(key, None):
+                self.dirty = True
+        return file_hash
+
+    def save(self):
+        """Write the index to disk, dropping entries for deleted files."""
+        with self.lock:
+            if self._entries is None:
+                return
+            for key in [k for k in self._entries if not os.path.exists(k)]:
+                del self._entries[key]
+                self.dirty = True
+            if self.dirty:
+                atomic_write(self.path, json_dumps(self._entries))
+                self.dirty = False
 
 
 def add_plugin_results(plugin, data, historical=False):
@@ -46,40 +164,274 @@ def add_plugin_results(plugin, data, historical=False):
     plist_path.write_bytes(plistlib.dumps(plugin_results))
 
 
-def get_checkin_results():
-    if os.path.exists(RESULTS_PATH):
-        with open(RESULTS_PATH) as results_handle:
+class ResultsStore:
+    """Checkin results loaded once, edited in place, and flushed once.
+
+    Checkin modules each write their own shard into the `.d` directory
+    next to the results file (see `set_checkin_results`). The shards are
+    merged over the main results document lazily, on first access.
+    Callers can then get or replace whole sections
+    (`store["Munki"] = ...`) or mutate the dicts returned by `section()`
+    directly; call `mark_dirty()` after editing in place so that
+    `flush()` knows to write the document back out.
+
+    Writes go to a temporary file in the same directory which is then
+    renamed over the results file, so a crash mid-write can never leave
+    a truncated document behind. Once the merged document has been
+    written, the shards it was built from are removed.
+    """
+
+    def __init__(self, path=None):
+        self.path = pathlib.Path(path or RESULTS_PATH)
+        self.shard_dir = self.path.with_suffix(".d")
+        self._data = None
+        self._shards = {}
+        self.dirty = False
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._load()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.dirty = True
+
+    def _load(self):
+        data = read_json(self.path)
+        if self.shard_dir.is_dir():
+            for shard in sorted(self.shard_dir.glob("*.json")):
+                try:
+                    mtime = shard.stat().st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                if shard_data := read_json(shard):
+                    data.update(shard_data)
+                    self._shards[shard] = mtime
+                    # Merged shards need to make it into the main
+                    # document before they can be removed.
+                    self.dirty = True
+                else:
+                    logging.warning("Skipping unreadable checkin results: %s", shard)
+        return data
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def __setitem__(self, name, value):
+        self.data[name] = value
+        self.dirty = True
+
+    def __contains__(self, name):
+        return name in self.data
+
+    def get(self, name, default=None):
+        return self.data.get(name, default)
+
+    def section(self, name):
+        """Return the named section, creating it if needed."""
+        if name not in self.data:
+            self[name] = {}
+        return self.data[name]
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def flush(self):
+        """Write the document to disk if anything has changed."""
+        if not self.dirty:
+            return
+        atomic_write(self.path, json_dumps(self.data))
+        self._remove_merged_shards()
+        self.dirty = False
+
+    def clear(self):
+        """Remove the results file, its shards and any loaded data."""
+        if self._data is None:
+            # Load to find out which shards there are to remove.
+            self._load()
+        self.path.unlink(missing_ok=True)
+        self._remove_merged_shards()
+        self._data = None
+        self.dirty = False
+
+    def _remove_merged_shards(self):
+        for shard, mtime in self._shards.items():
             try:
-                results = json.load(results_handle)
-            except json.decoder.JSONDecodeError:
-                results = {}
-    else:
-        results = {}
+                # Leave alone anything rewritten since we read it.
+                if shard.stat().st_mtime_ns == mtime:
+                    shard.unlink()
+            except FileNotFoundError:
+                pass
+        self._shards = {}
+
+
+def read_json(path):
+    """Return the JSON document at path, or {} if it's missing or bad."""
+    try:
+        return json_loads(pathlib.Path(path).read_bytes())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def atomic_write(path, data):
+    """Replace the contents of path with data (bytes) atomically."""
+    path = pathlib.Path(path)
+    handle = tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f".{path.name}.", delete=False
+    )
+    try:
+        with handle:
+            handle.write(data)
+        os.replace(handle.name, path)
+    except BaseException:
+        pathlib.Path(handle.name).unlink(missing_ok=True)
+        raise
+
+
+class LockFile:
+    """Exclusive lock on a file, for running one instance of a script.
+
+    The lock is an `flock()` on `<LOCK_DIR>/<name>.lock`, which the
+    kernel drops when the holder exits, however it exits. The holder's
+    PID is written to the file, for diagnostics only: a lock held after
+    that PID is gone has been inherited by a child which outlived it,
+    and is still live until the child exits.
+
+        lock = LockFile("sal-submit")
+        if not lock.acquire(timeout=3):
+            exit("Already running")
+    """
+
+    def __init__(self, name, lock_dir=None):
+        self.path = pathlib.Path(lock_dir or LOCK_DIR) / f"{name}.lock"
+        self.fd = None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise BlockingIOError(
+                errno.EWOULDBLOCK, f"{self.path} is held by {self.describe_holder()}"
+            )
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    @property
+    def acquired(self):
+        return self.fd is not None
+
+    def acquire(self, timeout=0, pause=0.5):
+        """Take the lock, waiting up to timeout seconds for it.
+
+        Returns whether the lock was taken.
+        """
+        if self.acquired:
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                if time.monotonic() >= deadline:
+                    logging.debug("%s is held by %s", self.path, self.describe_holder())
+                    return False
+                time.sleep(pause)
+                continue
+            # The file may have been unlinked (released or broken) between
+            # opening and locking it, in which case the lock is worthless.
+            try:
+                current = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current != os.fstat(fd).st_ino:
+                os.close(fd)
+                continue
+            os.ftruncate(fd, 0)
+            os.write(fd, f"{os.getpid()}\n".encode())
+            self.fd = fd
+            return True
+
+    def release(self):
+        if not self.acquired:
+            return
+        # Unlinked while still locked, so that no one else can lock this
+        # file after we let it go; see the inode check in acquire.
+        self.path.unlink(missing_ok=True)
+        os.close(self.fd)
+        self.fd = None
+
+    def holder(self):
+        """Return the PID recorded in the lock file, or None."""
+        try:
+            return int(self.path.read_text().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def describe_holder(self):
+        """Return who holds the lock, as best we can tell, for messages."""
+        pid = self.holder()
+        if pid is None:
+            return "an unknown process"
+        if not pid_exists(pid):
+            return f"a child of exited PID {pid}"
+        return f"PID {pid}"
 
-    return results
+    def is_locked(self):
+        """Return whether someone else holds the lock right now."""
+        if self.acquired:
+            return False
+        if not self.acquire():
+            return True
+        self.release()
+        return False
+
+
+def pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # It exists, but belongs to someone else.
+        return True
+    return True
+
+
+def get_checkin_results():
+    return ResultsStore().data
 
 
 def clean_results():
-    os.remove(RESULTS_PATH)
+    ResultsStore().clear()
 
 
 def save_results(data):
     """Replace all data in the results file."""
-    with open(RESULTS_PATH, "w") as results_handle:
-        json.dump(data, results_handle, default=serializer)
+    store = ResultsStore()
+    store.data = data
+    store.flush()
 
 
 def set_checkin_results(module_name, data):
-    """Set data by name to the shared results JSON file.
+    """Set data by name to this module's checkin results shard.
+
+    Each module writes its own file in the results `.d` directory, so
+    modules can run concurrently without clobbering each other. The
+    shards are merged by `ResultsStore` when the report is built.
     Existing data is overwritten.
     Args:
         module_name (str): Name of the management source returning data.
         data (dict): Dictionary of results.
     """
-    results = get_checkin_results()
-
-    results[module_name] = data
-    save_results(results)
+    shard_dir = pathlib.Path(RESULTS_PATH).with_suffix(".d")
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    shard = shard_dir / f"{module_name.replace(os.sep, '_')}.json"
+    atomic_write(shard, json_dumps({module_name: data}))
 
 
 def serializer(obj):
@@ -94,6 +446,263 @@ def serializer(obj):
     return obj
 
 
-def submission_encode(data: bytes) -> bytes:
-    """Return a b64 encoded, bz2 compressed copy of text."""
-    return base64.b64encode(bz2.compress(data))
+def register_unobjctify_handler(cls, kind=UNOBJCTIFY_LEAF, convert=None):
+    """Tell `unobjctify` how to convert instances of cls (and subclasses).
+
+    kind:
+        UNOBJCTIFY_LEAF: `convert(element, safe)` returns the converted
+            value.
+        UNOBJCTIFY_MAPPING: element's `items()` are converted into a
+            dict.
+        UNOBJCTIFY_SEQUENCE: element's items are converted into a list,
+            which is then passed to `convert`, if given (e.g. `tuple`).
+    """
+    if kind == UNOBJCTIFY_LEAF and convert is None:
+        raise ValueError("Leaf handlers need a convert function")
+    UNOBJCTIFY_HANDLERS[cls] = (kind, convert)
+    _unobjctify_resolved.clear()
+
+
+def _unobjctify_handler(cls):
+    try:
+        return _unobjctify_resolved[cls]
+    except KeyError:
+        pass
+    handler = None
+    for base in cls.__mro__:
+        if base in UNOBJCTIFY_HANDLERS:
+            handler = UNOBJCTIFY_HANDLERS[base]
+            break
+    if handler is None and _register_mac_handlers():
+        return _unobjctify_handler(cls)
+    _unobjctify_resolved[cls] = handler
+    return handler
+
+
+def _register_mac_handlers():
+    """Import sal.mac_utils for its NS type handlers, if it's not yet.
+
+    `import sal` doesn't import it, so the first unknown type does.
+    Returns whether this call registered any handlers.
+    """
+    if "sal.mac_utils" in sys.modules or platform.system() != "Darwin":
+        return False
+    try:
+        import sal.mac_utils
+    except ImportError:
+        return False
+    return True
+
+
+def unobjctify(element, safe=False):
+    """Convert nested elements to native python datatypes.
+
+    Types accepted include str, bytes, int, float, bool, None, list,
+    dict, set, tuple, and any registered with
+    `register_unobjctify_handler`; on macOS, `sal.mac_utils` registers
+    NSArray, NSDictionary, NSData, NSDate and NSNull.
+
+    element: Some (potentially) nested data you want to convert.
+
+    safe: Bool (defaults to False) whether you want printable
+        representations instead of the python equivalent. e.g.  NSDate
+        safe=True becomes a str, safe=False becomes a datetime.datetime.
+        NSData safe=True bcomes a hex str, safe=False becomes bytes. Any
+        type not explicitly handled by this module will raise an
+        exception unless safe=True, where it will instead replace the
+        data with a str of '<UNSUPPORTED TYPE>'
+
+        This is primarily for safety in serialization to plists or
+        output.
+
+    returns: Python equivalent of the original input.
+        e.g. NSArray -> List, NSDictionary -> Dict, etc.
+
+    raises: ValueError for any data that isn't supported (yet!) by this
+        function.
+    """
+    # The tree is walked with an explicit stack rather than recursion,
+    # so deep trees can't hit the recursion limit. Each task converts
+    # an element into target[slot]; containers are created empty and
+    # filled in as their items' tasks are processed.
+    # Leaves, most of the tree, are converted as their container is
+    # walked rather than going through the stack.
+    root = [None]
+    stack = [(element, root, 0)]
+    # Sequences rebuilt as another type once their items are converted,
+    # in the order they were found, so children come after parents.
+    finishers = []
+    while stack:
+        item, target, slot = stack.pop()
+        handler = _unobjctify_handler(type(item))
+        if handler is None:
+            if not safe:
+                raise ValueError(f"Element type '{type(item)}' is not supported!")
+            target[slot] = "<UNSUPPORTED TYPE>"
+            continue
+        kind, convert = handler
+        if kind == UNOBJCTIFY_LEAF:
+            target[slot] = convert(item, safe)
+            continue
+        if kind == UNOBJCTIFY_MAPPING:
+            result = target[slot] = {}
+            children = item.items()
+        else:
+            children = list(item)
+            result = target[slot] = [None] * len(children)
+            children = enumerate(children)
+            if convert is not None:
+                finishers.append((target, slot, convert))
+        for key, value in children:
+            handler = _unobjctify_resolved.get(type(value))
+            if handler is not None and handler[0] == UNOBJCTIFY_LEAF:
+                result[key] = handler[1](value, safe)
+            else:
+                # Set now to keep a mapping's key order.
+                result[key] = None
+                stack.append((value, result, key))
+    for target, slot, convert in reversed(finishers):
+        target[slot] = convert(target[slot])
+    return root[0]
+
+
+def _unchanged(element, safe):
+    return element
+
+
+# NSData and NSDate converters, registered by sal.mac_utils. They only
+# use the types' python-side behaviour, so they live here, where code
+# without Foundation (e.g. tools/bench_unobjctify.py) can use them too.
+def _convert_nsdata(element, safe):
+    return binascii.hexlify(element) if safe else bytes(element)
+
+
+def _convert_nsdate(element, safe):
+    if safe:
+        return str(element)
+    # Whole seconds, as NSDate's description (which this used to be
+    # parsed from) has.
+    seconds = math.floor(element.timeIntervalSince1970())
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+
+def json_dumps(data, sort_keys=False, indent=None) -> bytes:
+    """Return data as UTF-8 encoded JSON.
+
+    Datetimes and bytes are handled by `serializer`. orjson is used if
+    it's installed; otherwise (or if it can't encode data, e.g. ints
+    over 64 bits) json is, with the same compact, non-ASCII-escaping
+    output. NaN and infinities are written as json writes them (NaN,
+    Infinity), not as the null orjson writes.
+
+    indent: None for compact output, or 2.
+    """
+    if orjson is not None:
+        option = ORJSON_OPTIONS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            encoded = orjson.dumps(data, default=serializer, option=option)
+        except orjson.JSONEncodeError:
+            pass
+        else:
+            # orjson writes non-finite floats as null, so only output
+            # without any null can skip looking for them.
+            if b"null" not in encoded or not _has_non_finite(data):
+                return encoded
+    text = json.dumps(
+        data,
+        default=serializer,
+        sort_keys=sort_keys,
+        indent=indent,
+        separators=(",", ": ") if indent else (",", ":"),
+        ensure_ascii=False,
+    )
+    # Lone surrogates can't be UTF-8 encoded; backslashreplace writes
+    # them as the \uXXXX escapes json would have used.
+    return text.encode("utf-8", "backslashreplace")
+
+
+def _has_non_finite(data):
+    """Return whether data holds a NaN or infinite float, keys included."""
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            stack.extend(node.keys())
+            stack.extend(node.values())
+        elif isinstance(node, (list, tuple)):
+            stack.extend(node)
+        elif isinstance(node, float) and not math.isfinite(node):
+            return True
+    return False
+
+
+def json_loads(data):
+    """Return the document in data (str or bytes) decoded from JSON.
+
+    orjson is used if it's installed, falling back to json for what it
+    rejects but json accepts, e.g. escaped lone surrogates and NaN.
+    Integers outside 64 bits, which plists can't hold, are read as
+    floats by orjson.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def submission_encode(data, codec="bz2", level=None) -> bytes:
+    """Return a b64 encoded, compressed copy of data.
+
+    data: bytes, a path, or a binary file object. Paths and files are
+        read in chunks rather than all at once.
+    codec: One of SUBMISSION_CODECS. The server expects the default,
+        bz2, for all of its current submission endpoints.
+    level: Compression level (or lzma preset) for codec. Defaults to
+        the codec's own default; 9 for bz2.
+    """
+    return b"".join(iter_submission_encode(data, codec=codec, level=level))
+
+
+def iter_submission_encode(data, codec="bz2", level=None):
+    """Yield chunks of the b64 encoded, compressed data.
+
+    See `submission_encode` for arguments.
+    """
+    compressor = SUBMISSION_CODECS[codec](level)
+    pending = b""
+    for chunk in _iter_chunks(data):
+        pending += compressor.compress(chunk)
+        if (usable := len(pending) - len(pending) % 3) > 0:
+            yield base64.b64encode(pending[:usable])
+            pending = pending[usable:]
+    pending += compressor.flush()
+    yield base64.b64encode(pending)
+
+
+def _iter_chunks(data, chunk_size=SUBMISSION_CHUNK_SIZE):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            yield view[start : start + chunk_size]
+    elif isinstance(data, (str, os.PathLike)):
+        with open(data, "rb") as handle:
+            yield from iter(lambda: handle.read(chunk_size), b"")
+    else:
+        yield from iter(lambda: data.read(chunk_size), b"")
+
+
+for _type in (str, bytes, int, float, bool, datetime.datetime):
+    register_unobjctify_handler(_type, UNOBJCTIFY_LEAF, _unchanged)
+register_unobjctify_handler(
+    type(None), UNOBJCTIFY_LEAF, lambda element, safe: "" if safe else None
+)
+register_unobjctify_handler(dict, UNOBJCTIFY_MAPPING)
+register_unobjctify_handler(list, UNOBJCTIFY_SEQUENCE)
+register_unobjctify_handler(set, UNOBJCTIFY_SEQUENCE, set)
+register_unobjctify_handler(tuple, UNOBJCTIFY_SEQUENCE, tuple)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""bench_client_e2e
+
+Drive sal-submit's network phases against the local stand-in server.
+
+sal-submit is loaded from the payload, with its Munki directory and
+profiles swapped for synthetic fixtures, and then `send_checkin` and
+`send_uploads` (inventory, catalogs and profiles) are run against a
+`sal_standin_server` in-process. Runs on Linux with no network.
+
+The first round starts with an empty server, so everything is
+uploaded; later rounds only find out that nothing has changed. For
+each round and phase this reports wall time, requests, errors and
+request and response body bytes.
+
+    tools/bench_client_e2e.py --latency 0.05 --bandwidth 1000000
+"""
+
+
+import argparse
+import asyncio
+import copy
+import importlib.machinery
+import importlib.util
+import logging
+import pathlib
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "sal_python_pkg"))
+import sal
+from sal.client import RetryPolicy
+
+from bench_submission_encode import make_catalog, make_inventory
+from sal_standin_server import make_server
+
+
+SAL_SUBMIT = pathlib.Path(__file__).resolve().parents[1] / (
+    "payload/usr/local/sal/bin/sal-submit"
+)
+SERIAL = "C02BENCHMARK"
+
+
+def load_sal_submit():
+    loader = importlib.machinery.SourceFileLoader("sal_submit", str(SAL_SUBMIT))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def send_checkin(submit, report):
+    try:
+        submit.send_checkin(report)
+    except requests.exceptions.RequestException as error:
+        logging.error("Failed to send report: %s", error)
+
+
+def make_report(count, rng, serial=SERIAL):
+    """Return a checkin report shaped like the bundled modules' output."""
+    return {
+        "Machine": {
+            "extra_data": {
+                "serial": serial,
+                "hostname": "bench",
+                "os_family": "Darwin",
+            },
+            "facts": {f"fact_{index}": str(rng.random()) for index in range(50)},
+        },
+        "Sal": {
+            "extra_data": {"key": "benchkey", "sal_version": sal.__version__},
+            "facts": {"checkin_module_version": "1.1.0"},
+        },
+        "Munki": {
+            "extra_data": {"manifest": "site_default"},
+            "managed_items": {
+                f"Package{index}": {
+                    "date_managed": "2021-01-01T00:00:00Z",
+                    "status": "PRESENT",
+                    "data": {"version": f"{rng.randint(1, 20)}.0"},
+                }
+                for index in range(count)
+            },
+        },
+    }
+
+
+def make_profiles(count):
+    return {
+        "_computerlevel": [
+            {
+                "ProfileIdentifier": f"com.example.profile{index}",
+                "ProfileItems": [
+                    {
+                        "PayloadIdentifier": f"com.example.payload{index}",
+                        "PayloadUUID": f"{index:08d}-0000-0000-0000-000000000000",
+                        "PayloadType": "com.apple.ManagedClient.preferences",
+                        "PayloadContent": {"setting": "value" * 20},
+                    }
+                ],
+            }
+            for index in range(count)
+        ]
+    }
+
+
+def make_fixtures(root, args, rng):
+    managed = root / "Managed Installs"
+    (managed / "catalogs").mkdir(parents=True)
+    (managed / "ApplicationInventory.plist").write_bytes(make_inventory(args.apps, rng))
+    for index in range(args.catalogs):
+        (managed / "catalogs" / f"catalog{index}").write_bytes(
+            make_catalog(args.pkginfos, rng)
+        )
+    return managed
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    server = make_server(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        bandwidth=args.bandwidth,
+        seed=args.seed,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    submit = load_sal_submit()
+    client = sal.get_sal_client()
+    client.base_url = server.url
+    client.auth = ("sal", "benchkey")
+    client.compression = args.compression
+    client.retry_policy = RetryPolicy(attempts=args.attempts, backoff=0.05)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = pathlib.Path(temp_dir)
+        managed = make_fixtures(root, args, rng)
+        profiles = make_profiles(args.profiles)
+        report = make_report(args.managed_items, rng)
+
+        async def get_profiles(sal_client):
+            return copy.deepcopy(profiles)
+
+        submit.get_managed_install_dir = lambda: managed
+        submit.get_profiles = get_profiles
+        submit.CATALOG_STATE_PATH = root / "catalog_state.json"
+
+        print(
+            f"{'round':<6} {'phase':<8} {'seconds':>8} {'requests':>8} "
+            f"{'errors':>6} {'bytes up':>10} {'bytes down':>10}"
+        )
+        for round_number in range(1, args.rounds + 1):
+            hash_index = sal.HashIndex(root / "hash_index.json")
+            phases = (
+                ("checkin", lambda: send_checkin(submit, report)),
+                (
+                    "uploads",
+                    lambda: asyncio.run(
+                        submit.send_uploads(
+                            SERIAL,
+                            hash_index,
+                            concurrency=args.concurrency,
+                            timeout=args.timeout,
+                        )
+                    ),
+                ),
+            )
+            for phase, func in phases:
+                server.state.reset_requests()
+                client.circuit_breaker.record_success()
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+                totals = server.state.totals()
+                print(
+                    f"{round_number:<6} {phase:<8} {elapsed:>8.3f} "
+                    f"{totals['requests']:>8} {totals['errors']:>6} "
+                    f"{totals['bytes_up']:>10} {totals['bytes_down']:>10}"
+                )
+            hash_index.save()
+
+    summary = client.metrics.summary()
+    print(
+        f"{summary['connections']} connection(s) opened for "
+        f"{summary['requests']} request(s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--apps", type=int, default=4000, help="Inventory items.")
+    parser.add_argument("--catalogs", type=int, default=3, help="Catalog files.")
+    parser.add_argument("--pkginfos", type=int, default=2000, help="Per catalog.")
+    parser.add_argument("--profiles", type=int, default=20)
+    parser.add_argument("--managed-items", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=int, help="Server bytes per second.")
+    parser.add_argument("--compression", choices=("gzip", "zstd"))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout", type=float, help="Upload deadline, seconds.")
+    parser.add_argument("--attempts", type=int, default=3, help="Retry attempts.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-d", "--debug", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
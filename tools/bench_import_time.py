@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""bench_import_time
+
+Measure what `import sal` costs the scripts that use it, with
+`python -X importtime`, and fail if it regresses.
+
+Each scenario runs in a fresh interpreter --repeat times; the time
+reported is the best run's cumulative import time for everything the
+scenario imports beyond a bare interpreter's startup. The bare
+`import sal` must stay under --max-ms, and must not import any of
+HEAVY_MODULES; those should only load when a script uses them.
+
+    tools/bench_import_time.py --repeat 10 --max-ms 80
+"""
+
+
+import argparse
+import os
+import pathlib
+import subprocess
+import sys
+
+
+SAL_PYTHON_PKG = pathlib.Path(__file__).resolve().parents[1] / "sal_python_pkg"
+SCENARIOS = (
+    ("import sal", "import sal"),
+    ("checkin module", "import sal; sal.set_checkin_results"),
+    ("munki preflight", "import sal; sal.run_scripts"),
+    ("sal-submit", "import sal; sal.get_sal_client; sal.Spool; sal.CheckinState"),
+)
+HEAVY_MODULES = (
+    "Foundation",
+    "asyncio",
+    "objc",
+    "requests",
+    "sal.client",
+    "sal.mac_utils",
+    "urllib3",
+)
+
+
+def run_python(code, importtime=False):
+    env = dict(os.environ, PYTHONPATH=str(SAL_PYTHON_PKG))
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    return subprocess.run(
+        cmd + ["-c", code], env=env, capture_output=True, text=True, check=True
+    )
+
+
+def import_times(code):
+    """Return {module: cumulative microseconds} for top level imports."""
+    times = {}
+    for line in run_python(code, importtime=True).stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Nested imports are indented under the module importing them.
+        if not name.startswith(" " * 2):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def scenario_time(code, baseline, repeat):
+    """Return the best cumulative ms imported by code beyond baseline."""
+    best = None
+    for _ in range(repeat):
+        times = import_times(code)
+        total = sum(t for name, t in times.items() if name not in baseline)
+        best = total if best is None else min(best, total)
+    return best / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        default=80,
+        help="Fail if a bare `import sal` takes longer than this.",
+    )
+    args = parser.parse_args()
+
+    baseline = set(import_times("pass"))
+    print(f"{'scenario':<16} {'import ms':>9}")
+    results = {}
+    for name, code in SCENARIOS:
+        results[name] = scenario_time(code, baseline, args.repeat)
+        print(f"{name:<16} {results[name]:>9.1f}")
+
+    failures = []
+    loaded = run_python("import sal, sys; print('\\n'.join(sys.modules))")
+    heavy = sorted(set(loaded.stdout.split()) & set(HEAVY_MODULES))
+    if heavy:
+        failures.append(f"`import sal` imports {', '.join(heavy)}")
+    if results["import sal"] > args.max_ms:
+        failures.append(
+            f"`import sal` took {results['import sal']:.1f}ms (max {args.max_ms}ms)"
+        )
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""bench_serialization
+
+Check and time `sal.json_dumps` and `sal.json_loads` with and without
+orjson, on a large synthetic checkin report.
+
+The conformance check encodes edge cases (naive and aware datetimes,
+bytes, non-ASCII and lone surrogate strings, non-str keys, big ints,
+NaN and infinities) and the report through both paths, compact,
+key-sorted and indented, and requires every result to decode to what
+the old `json.dumps(data, default=serializer)` gives. It exits non-zero if
+anything differs, or if the two paths' canonical (key-sorted) output
+for the report isn't byte-identical.
+
+    tools/bench_serialization.py --managed-items 20000
+"""
+
+
+import argparse
+import datetime
+import json
+import pathlib
+import random
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "sal_python_pkg"))
+from sal import utils
+
+
+EDGE_CASES = {
+    "naive datetime": datetime.datetime(2021, 1, 2, 3, 4, 5, 678),
+    "utc datetime": datetime.datetime(
+        2021, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc
+    ),
+    "offset datetime": datetime.datetime(
+        2021, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=-5))
+    ),
+    "bytes": b"\x00\x01binary",
+    "non-ascii": "Café ☕ 日本語",
+    "lone surrogate": "bad \udcff text",
+    "int keys": {1: "one", 2: "two"},
+    "big int": 2**70,
+    "nan": {"value": float("nan"), "null": None},
+    "infinity": [float("inf"), float("-inf")],
+    "non-finite keys": {float("nan"): 1, float("inf"): 2},
+    "nested": {"list": [1, 2.5, None, True, "x"], "tuple": (1, "two")},
+}
+
+
+def make_report(count, rng):
+    """Return a checkin report shaped like sal-submit's, with dates."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return {
+        "Machine": {
+            "extra_data": {"serial": "C02BENCHMARK", "hostname": "bench"},
+            "facts": {f"fact_{index}": str(rng.random()) for index in range(200)},
+        },
+        "Sal": {
+            "extra_data": {"key": "benchkey"},
+            "facts": {"checkin_module_version": "1.1.0"},
+        },
+        "Munki": {
+            "extra_data": {"manifest": "site_default", "runtype": "auto"},
+            "facts": {"StartTime": now, "EndTime": now},
+            "managed_items": {
+                f"Package{index}": {
+                    "date_managed": now - datetime.timedelta(seconds=index),
+                    "status": rng.choice(["PRESENT", "PENDING", "ERROR"]),
+                    "data": {
+                        "version": f"{rng.randint(1, 20)}.0",
+                        "display_name": f"Päckage {index}",
+                        "installed_size": rng.randint(1000, 4000000),
+                        "receipt": b"\x00" * 8,
+                    },
+                }
+                for index in range(count)
+            },
+        },
+    }
+
+
+def legacy_dumps(data):
+    return json.dumps(data, default=utils.serializer).encode()
+
+
+def same(a, b):
+    """Return whether decoded JSON a and b are equal, NaN included."""
+    if isinstance(a, float) and isinstance(b, float) and a != a and b != b:
+        return True
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def with_backend(orjson_module, func, *args, **kwargs):
+    saved = utils.orjson
+    utils.orjson = orjson_module
+    try:
+        return func(*args, **kwargs)
+    finally:
+        utils.orjson = saved
+
+
+def check_conformance(report):
+    backends = {"stdlib": None}
+    if utils.orjson is not None:
+        backends["orjson"] = utils.orjson
+    failures = []
+    cases = dict(EDGE_CASES, report=report)
+    for name, data in cases.items():
+        expected = json.loads(legacy_dumps(data))
+        for backend, module in backends.items():
+            for options in ({}, {"sort_keys": True}, {"indent": 2}):
+                encoded = with_backend(module, utils.json_dumps, data, **options)
+                loaded = with_backend(module, utils.json_loads, encoded)
+                if not same(loaded, expected):
+                    failures.append(f"{name} ({backend}, {options})")
+    if "orjson" in backends:
+        canonical = {
+            backend: with_backend(module, utils.json_dumps, report, sort_keys=True)
+            for backend, module in backends.items()
+        }
+        if canonical["stdlib"] != canonical["orjson"]:
+            failures.append("canonical output differs between backends")
+    return list(backends), failures
+
+
+def bench(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--managed-items", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = make_report(args.managed_items, random.Random(args.seed))
+    backends, failures = check_conformance(report)
+    if failures:
+        sys.exit("Conformance failures:\n  " + "\n  ".join(failures))
+    print(f"Conformance: {', '.join(backends)} match legacy json output")
+
+    rows = [("legacy", lambda: legacy_dumps(report), json.loads)]
+    for backend in backends:
+        module = utils.orjson if backend == "orjson" else None
+        rows.append(
+            (
+                backend,
+                lambda m=module: with_backend(m, utils.json_dumps, report),
+                lambda data, m=module: with_backend(m, utils.json_loads, data),
+            )
+        )
+    print(f"{'encoder':<8} {'dumps s':>8} {'loads s':>8} {'bytes':>10}")
+    for name, dumps, loads in rows:
+        dumps_time, encoded = bench(dumps, args.repeat)
+        loads_time, _ = bench(lambda: loads(encoded), args.repeat)
+        print(f"{name:<8} {dumps_time:>8.3f} {loads_time:>8.3f} {len(encoded):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""bench_submission_encode
+
+Compare the codecs available to `sal.submission_encode` on synthetic
+ApplicationInventory.plist- and catalog-shaped data.
+
+For each codec and level this reports encode throughput, the encoded
+size as a fraction of the input, and the peak memory allocated while
+encoding. The "legacy" row is the old whole-file approach of reading
+the bytes, bz2 compressing them and then base64 encoding the result.
+
+    tools/bench_submission_encode.py --apps 4000 --pkginfos 6000
+"""
+
+
+import argparse
+import base64
+import bz2
+import pathlib
+import plistlib
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "sal_python_pkg"))
+from sal.utils import submission_encode
+
+
+CODECS = (
+    ("bz2", 9),
+    ("bz2", 1),
+    ("zlib", 6),
+    ("zlib", 1),
+    ("lzma", 6),
+    ("lzma", 0),
+)
+
+
+def make_inventory(count, rng):
+    """Return plist bytes shaped like Munki's ApplicationInventory.plist."""
+    vendors = ["Apple", "Adobe", "Microsoft", "Google", "Mozilla", "JetBrains"]
+    items = []
+    for index in range(count):
+        vendor = rng.choice(vendors)
+        name = f"{vendor} App {index}"
+        items.append(
+            {
+                "CFBundleName": name,
+                "bundleid": f"com.{vendor.lower()}.app{index}",
+                "name": name,
+                "path": f"/Applications/{name}.app",
+                "version": f"{rng.randint(1, 30)}.{rng.randint(0, 9)}.{rng.randint(0, 99)}",
+            }
+        )
+    return plistlib.dumps(items)
+
+
+def make_catalog(count, rng):
+    """Return plist bytes shaped like a Munki catalog."""
+    items = []
+    for index in range(count):
+        name = f"Package{index % (count // 4 or 1)}"
+        version = f"{rng.randint(1, 20)}.{rng.randint(0, 9)}"
+        items.append(
+            {
+                "name": name,
+                "display_name": f"{name} Display Name",
+                "version": version,
+                "catalogs": ["production", "testing"],
+                "description": "Synthetic package for benchmarking. " * 4,
+                "installer_item_location": f"apps/{name}-{version}.pkg",
+                "installer_item_hash": "%064x" % rng.getrandbits(256),
+                "installer_item_size": rng.randint(1000, 2000000),
+                "installed_size": rng.randint(1000, 4000000),
+                "minimum_os_version": "10.15",
+                "receipts": [
+                    {
+                        "packageid": f"com.example.{name.lower()}",
+                        "version": version,
+                        "installed_size": rng.randint(1000, 4000000),
+                    }
+                ],
+                "unattended_install": bool(index % 2),
+                "uninstallable": True,
+            }
+        )
+    return plistlib.dumps(items)
+
+
+def legacy_encode(path):
+    return base64.b64encode(bz2.compress(pathlib.Path(path).read_bytes()))
+
+
+def measure(func, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run(fixtures, repeat):
+    print(
+        f"{'fixture':<10} {'codec':<8} {'level':>5} {'MB/s':>8} {'ratio':>7} "
+        f"{'peak MB':>8}"
+    )
+    for label, path in fixtures:
+        size = path.stat().st_size
+        rows = [("legacy", "", lambda: legacy_encode(path))]
+        rows += [
+            (codec, level, lambda c=codec, lvl=level: submission_encode(path, c, lvl))
+            for codec, level in CODECS
+        ]
+        for codec, level, func in rows:
+            best = None
+            for _ in range(repeat):
+                encoded, elapsed, peak = measure(func)
+                if best is None or elapsed < best[0]:
+                    best = (elapsed, peak)
+            elapsed, peak = best
+            print(
+                f"{label:<10} {codec:<8} {level!s:>5} "
+                f"{size / elapsed / 1e6:>8.1f} {len(encoded) / size:>7.3f} "
+                f"{peak / 1e6:>8.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apps", type=int, default=4000, help="Inventory items.")
+    parser.add_argument("--pkginfos", type=int, default=6000, help="Catalog items.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per codec.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        inventory = pathlib.Path(temp_dir) / "ApplicationInventory.plist"
+        inventory.write_bytes(make_inventory(args.apps, rng))
+        catalog = pathlib.Path(temp_dir) / "all"
+        catalog.write_bytes(make_catalog(args.pkginfos, rng))
+        for label, path in (("inventory", inventory), ("catalog", catalog)):
+            print(f"{label}: {path.stat().st_size / 1e6:.2f} MB")
+        run((("inventory", inventory), ("catalog", catalog)), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""bench_unobjctify
+
+Compare `sal.unobjctify` with the recursive implementation it replaced,
+on a synthetic ManagedInstallReport-shaped tree.
+
+pyobjc isn't needed: the tree is built from stand-ins for NSDictionary,
+NSArray, NSDate and NSData, registered with `unobjctify` using the
+converters `sal.mac_utils` registers for the real types. Both
+implementations must give the same result. A deep, narrow tree is also
+converted, which the recursive implementation can't do past the
+recursion limit.
+
+    tools/bench_unobjctify.py --items 20000
+"""
+
+
+import argparse
+import binascii
+import collections.abc
+import datetime
+import pathlib
+import random
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "sal_python_pkg"))
+from sal import utils
+
+
+ISO_TIME_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+
+class StandinNSDictionary(collections.abc.Mapping):
+    def __init__(self, data):
+        self.data = data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class StandinNSArray(collections.abc.Sequence):
+    def __init__(self, items):
+        self.items = items
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __len__(self):
+        return len(self.items)
+
+
+class StandinNSDate:
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+
+    def timeIntervalSince1970(self):
+        return self.timestamp
+
+    def description(self):
+        when = datetime.datetime.fromtimestamp(self.timestamp, datetime.timezone.utc)
+        return when.strftime(ISO_TIME_FORMAT)
+
+    def __str__(self):
+        return self.description()
+
+
+class StandinNSData(bytes):
+    pass
+
+
+def legacy_unobjctify(element, safe=False):
+    """The recursive unobjctify, with the stand-in types."""
+    supported_types = (str, bytes, int, float, bool, datetime.datetime)
+    if isinstance(element, StandinNSData):
+        return binascii.hexlify(element) if safe else bytes(element)
+    elif isinstance(element, supported_types):
+        return element
+    elif isinstance(element, (dict, StandinNSDictionary)):
+        return {k: legacy_unobjctify(v, safe=safe) for k, v in element.items()}
+    elif isinstance(element, (list, StandinNSArray)):
+        return [legacy_unobjctify(i, safe=safe) for i in element]
+    elif isinstance(element, set):
+        return {legacy_unobjctify(i, safe=safe) for i in element}
+    elif isinstance(element, tuple):
+        return tuple([legacy_unobjctify(i, safe=safe) for i in element])
+    elif isinstance(element, StandinNSDate):
+        return (
+            str(element)
+            if safe
+            else datetime.datetime.strptime(element.description(), ISO_TIME_FORMAT)
+        )
+    elif element is None:
+        return "" if safe else None
+    elif safe:
+        return "<UNSUPPORTED TYPE>"
+    raise ValueError(f"Element type '{type(element)}' is not supported!")
+
+
+def register_standins():
+    """Register the stand-ins with sal.mac_utils' converters."""
+    utils.register_unobjctify_handler(StandinNSDictionary, utils.UNOBJCTIFY_MAPPING)
+    utils.register_unobjctify_handler(StandinNSArray, utils.UNOBJCTIFY_SEQUENCE)
+    utils.register_unobjctify_handler(
+        StandinNSData, utils.UNOBJCTIFY_LEAF, utils._convert_nsdata
+    )
+    utils.register_unobjctify_handler(
+        StandinNSDate, utils.UNOBJCTIFY_LEAF, utils._convert_nsdate
+    )
+
+
+def make_report(count, rng):
+    """Return a stand-in tree shaped like ManagedInstallReport.plist."""
+
+    def date():
+        return StandinNSDate(rng.uniform(1.5e9, 1.8e9))
+
+    def item(index):
+        return StandinNSDictionary(
+            {
+                "name": f"Package{index}",
+                "display_name": f"Package {index}",
+                "installed": rng.random() > 0.1,
+                "installed_size": rng.randint(1000, 4000000),
+                "installed_version": f"{rng.randint(1, 20)}.0",
+                "time": date(),
+                "data": StandinNSData(rng.randbytes(16)),
+                "receipts": StandinNSArray(
+                    [
+                        StandinNSDictionary(
+                            {"packageid": f"com.example.p{index}.{n}", "time": date()}
+                        )
+                        for n in range(2)
+                    ]
+                ),
+            }
+        )
+
+    return StandinNSDictionary(
+        {
+            "StartTime": date(),
+            "EndTime": date(),
+            "Errors": StandinNSArray([]),
+            "MachineInfo": StandinNSDictionary(
+                {"os_vers": "14.5", "arch": "arm64", "serial": None}
+            ),
+            "ManagedInstalls": StandinNSArray([item(i) for i in range(count)]),
+            "InstallResults": StandinNSArray(
+                [
+                    StandinNSDictionary({"name": f"Package{i}", "time": date()})
+                    for i in range(count // 10)
+                ]
+            ),
+            "ItemsToInstall": (1, 2, {"a", "b"}),
+        }
+    )
+
+
+def make_deep(depth):
+    tree = "leaf"
+    for _ in range(depth):
+        tree = StandinNSDictionary({"child": StandinNSArray([tree])})
+    return tree
+
+
+def bench(func, tree, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(tree)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def count_nodes(tree):
+    count, stack = 0, [tree]
+    while stack:
+        node = stack.pop()
+        count += 1
+        if isinstance(node, dict):
+            stack.extend(node.values())
+        elif isinstance(node, (list, tuple, set)):
+            stack.extend(node)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=20000, help="Managed items.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--depth", type=int, default=5000, help="Deep tree levels.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    register_standins()
+    tree = make_report(args.items, random.Random(args.seed))
+    print(f"{'implementation':<16} {'safe':<5} {'seconds':>8}")
+    for safe in (False, True):
+        legacy, expected = bench(
+            lambda t: legacy_unobjctify(t, safe=safe), tree, args.repeat
+        )
+        table, result = bench(
+            lambda t: utils.unobjctify(t, safe=safe), tree, args.repeat
+        )
+        if result != expected:
+            sys.exit(f"unobjctify(safe={safe}) differs from the legacy result")
+        print(f"{'legacy':<16} {safe!s:<5} {legacy:>8.3f}")
+        print(f"{'table-driven':<16} {safe!s:<5} {table:>8.3f}")
+    print(f"{count_nodes(expected)} nodes; results match")
+
+    deep = make_deep(args.depth)
+    start = time.perf_counter()
+    utils.unobjctify(deep)
+    print(
+        f"{args.depth} levels deep: {time.perf_counter() - start:.3f}s "
+        f"(recursion limit {sys.getrecursionlimit()})"
+    )
+
+
+if __name__ == "__main__":
+    main()
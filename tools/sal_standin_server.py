@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""sal_standin_server
+
+A small local stand-in for the Sal server endpoints that sal-scripts
+talk to, for exercising the client without a real server.
+
+Run it directly and point a client at it:
+
+    tools/sal_standin_server.py --port 8000
+    sudo /usr/local/sal/bin/sal-submit --url http://127.0.0.1:8000
+
+or start one in-process with `make_server()`.
+
+Latency, errors and bandwidth can be dialed in to mimic a slow or
+flaky server: every request is delayed by --latency seconds, answered
+with HTTP 503 at random --error-rate of the time, and has its request
+and response bodies paced to --bandwidth bytes per second.
+
+Answers from inventory/hash/ and preflight-v2/ carry an ETag, and a
+request whose If-None-Match has it gets HTTP 304, as from a real
+server in front of a cache.
+"""
+
+
+import argparse
+import base64
+import bz2
+import gzip
+import hashlib
+import json
+import logging
+import lzma
+import pathlib
+import plistlib
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "sal_python_pkg"))
+from sal.delta import apply_delta, heartbeat_digest
+
+
+# Errors raised by a malformed submission.
+MALFORMED = (ValueError, KeyError, TypeError, OSError, EOFError, lzma.LZMAError)
+
+
+class StandinState:
+    """What the stand-in server has been sent, and how it behaves."""
+
+    def __init__(
+        self,
+        accept_encodings=("gzip", "zstd"),
+        latency=0.0,
+        error_rate=0.0,
+        bandwidth=None,
+        scripts=None,
+        seed=None,
+    ):
+        self.lock = threading.Lock()
+        self.accept_encodings = set(accept_encodings)
+        if zstandard is None:
+            self.accept_encodings.discard("zstd")
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bandwidth = bandwidth
+        self.random = random.Random(seed)
+        self.reports = {}
+        # Every report accepted for each serial, in the order received.
+        self.history = {}
+        # Heartbeats accepted for each serial.
+        self.heartbeats = {}
+        # sha256 of the last inventory submitted for each serial.
+        self.inventory_hashes = {}
+        # sha256 of the last submission of each catalog, by name.
+        self.catalog_hashes = {}
+        self.profiles = {}
+        # External scripts offered by preflight-v2, as
+        # {"plugin": ..., "filename": ..., "content": ...} dicts.
+        self.scripts = list(scripts or [])
+        self.requests = []
+
+    def record(self, method, path, status, size, encoding=None, response_size=0):
+        with self.lock:
+            self.requests.append(
+                {
+                    "method": method,
+                    "path": path,
+                    "status": status,
+                    "bytes": size,
+                    "response_bytes": response_size,
+                    "encoding": encoding,
+                }
+            )
+
+    def reset_requests(self):
+        with self.lock:
+            self.requests = []
+
+    def totals(self):
+        """Return the request count, errors and body bytes each way."""
+        with self.lock:
+            return {
+                "requests": len(self.requests),
+                "errors": sum(r["status"] >= 400 for r in self.requests),
+                "bytes_up": sum(r["bytes"] for r in self.requests),
+                "bytes_down": sum(r["response_bytes"] for r in self.requests),
+            }
+
+    def inject_error(self):
+        with self.lock:
+            return bool(self.error_rate) and self.random.random() < self.error_rate
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server_version = "SalStandin/1.0"
+    # Keep connections alive between requests, like a real server.
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        state = self.server.state
+        route = self.path.strip("/")
+        self.request_info = ("GET", route, 0, None)
+        self.pace(0, state.latency)
+        if route.startswith("inventory/hash/"):
+            handler = self.inventory_hash
+        elif route.startswith("preflight-v2/get-script/"):
+            handler = self.get_script
+        else:
+            handler = None
+
+        if handler is None:
+            self.respond(404, b"Not found")
+        elif state.inject_error():
+            self.respond(503, b"Injected error")
+        else:
+            handler(route)
+
+    def do_POST(self):
+        state = self.server.state
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        route = self.path.strip("/")
+        encoding = self.headers.get("Content-Encoding")
+        self.request_info = ("POST", route, len(raw), encoding)
+        self.pace(len(raw), state.latency)
+        handler = {
+            "checkin": self.checkin,
+            "checkin/delta": self.checkin_delta,
+            "checkin/batch": self.checkin_batch,
+            "checkin/heartbeat": self.checkin_heartbeat,
+            "inventory/submit": self.inventory_submit,
+            "catalog/hash": self.catalog_hash,
+            "catalog/submit": self.catalog_submit,
+            "profiles/submit": self.profiles_submit,
+            "preflight-v2": self.preflight,
+        }.get(route)
+        if handler is None:
+            self.respond(404, b"Not found")
+        elif encoding and encoding not in state.accept_encodings:
+            self.respond(415, f"Unsupported Content-Encoding {encoding}".encode())
+        elif state.inject_error():
+            self.respond(503, b"Injected error")
+        else:
+            handler(self.decode_body(raw, encoding))
+
+    def pace(self, size, latency=0.0):
+        """Sleep for latency plus the time size bytes take to transfer."""
+        bandwidth = self.server.state.bandwidth
+        delay = latency + (size / bandwidth if bandwidth else 0.0)
+        if delay:
+            time.sleep(delay)
+
+    def decode_body(self, body, encoding):
+        if encoding == "gzip":
+            return gzip.decompress(body)
+        elif encoding == "zstd":
+            return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        return body
+
+    def checkin(self, body):
+        try:
+            report = self.parse_json(body)
+            serial = report["Machine"]["extra_data"]["serial"]
+        except (ValueError, KeyError, TypeError):
+            self.respond(400, b"Malformed report")
+            return
+        with self.server.state.lock:
+            self.server.state.reports[serial] = report
+            self.server.state.history.setdefault(serial, []).append(report)
+        self.respond(200, f"Sal report submmitted for {serial}".encode())
+
+    def checkin_delta(self, body):
+        try:
+            delta = self.parse_json(body)
+            serial = delta["serial"]
+        except (ValueError, KeyError, TypeError):
+            self.respond(400, b"Malformed delta")
+            return
+        with self.server.state.lock:
+            stored = self.server.state.reports.get(serial)
+            if stored is None:
+                self.respond(409, b"No report to apply delta to; send a full report")
+                return
+            try:
+                # Apply to a copy so a bad delta leaves the stored report alone.
+                report = apply_delta(json.loads(json.dumps(stored)), delta)
+            except (ValueError, KeyError, TypeError) as error:
+                self.respond(409, f"Resync required: {error}".encode())
+                return
+            self.server.state.reports[serial] = report
+            self.server.state.history.setdefault(serial, []).append(report)
+        self.respond(200, f"Sal delta applied for {serial}".encode())
+
+    def checkin_batch(self, body):
+        try:
+            entries = self.parse_json(body)["reports"]
+            reports = [
+                (entry["report"]["Machine"]["extra_data"]["serial"], entry["report"])
+                for entry in entries
+            ]
+        except (ValueError, KeyError, TypeError):
+            self.respond(400, b"Malformed batch")
+            return
+        with self.server.state.lock:
+            # Spooled reports are history; the client has already sent
+            # its current report, which stays the machine's state.
+            for serial, report in reports:
+                self.server.state.reports.setdefault(serial, report)
+                self.server.state.history.setdefault(serial, []).append(report)
+        self.respond(200, f"{len(reports)} spooled report(s) submitted".encode())
+
+    def checkin_heartbeat(self, body):
+        try:
+            heartbeat = self.parse_json(body)
+            serial = heartbeat["serial"]
+            expected = heartbeat["digest"]
+        except (ValueError, KeyError, TypeError):
+            self.respond(400, b"Malformed heartbeat")
+            return
+        with self.server.state.lock:
+            stored = self.server.state.reports.get(serial)
+            matches = stored is not None and heartbeat_digest(stored) == expected
+            if matches:
+                self.server.state.heartbeats[serial] = (
+                    self.server.state.heartbeats.get(serial, 0) + 1
+                )
+        if matches:
+            self.respond(200, f"Sal heartbeat received for {serial}".encode())
+        else:
+            self.respond(409, b"Report has changed; send a full report")
+
+    def inventory_hash(self, route):
+        serial = route[len("inventory/hash/") :]
+        with self.server.state.lock:
+            inventory_hash = self.server.state.inventory_hashes.get(serial, "")
+        self.respond_cacheable(inventory_hash.encode())
+
+    def inventory_submit(self, body):
+        try:
+            form = self.parse_json(body)
+            serial = form["serial"]
+            inventory = decode_submission(form["base64bz2inventory"])
+        except MALFORMED:
+            self.respond(400, b"Malformed inventory")
+            return
+        with self.server.state.lock:
+            self.server.state.inventory_hashes[serial] = hashlib.sha256(
+                inventory
+            ).hexdigest()
+        self.respond(200, b"Inventory submitted")
+
+    def catalog_hash(self, body):
+        try:
+            form = self.parse_json(body)
+            catalogs = plistlib.loads(decode_submission(form["catalogs"]))
+        except MALFORMED:
+            self.respond(400, b"Malformed catalog hashes")
+            return
+        with self.server.state.lock:
+            known = [
+                c
+                for c in catalogs
+                if self.server.state.catalog_hashes.get(c["name"]) == c["sha256hash"]
+            ]
+        self.respond(200, plistlib.dumps(known), "application/xml")
+
+    def catalog_submit(self, body):
+        try:
+            form = self.parse_json(body)
+            catalog = decode_submission(form["base64bz2catalog"])
+            name = form["name"]
+        except MALFORMED:
+            self.respond(400, b"Malformed catalog")
+            return
+        with self.server.state.lock:
+            self.server.state.catalog_hashes[name] = hashlib.sha256(catalog).hexdigest()
+        self.respond(200, b"Catalogs submitted")
+
+    def profiles_submit(self, body):
+        try:
+            form = self.parse_json(body)
+            serial = form["serial"]
+            profiles = plistlib.loads(decode_submission(form["base64bz2profiles"]))
+        except MALFORMED:
+            self.respond(400, b"Malformed profiles")
+            return
+        with self.server.state.lock:
+            self.server.state.profiles[serial] = profiles
+        self.respond(200, b"Profiles submitted")
+
+    def preflight(self, body):
+        with self.server.state.lock:
+            scripts = [
+                {
+                    "plugin": s["plugin"],
+                    "filename": s["filename"],
+                    "hash": hashlib.sha256(s["content"].encode()).hexdigest(),
+                }
+                for s in self.server.state.scripts
+            ]
+        self.respond_cacheable(json.dumps(scripts).encode(), "application/json")
+
+    def get_script(self, route):
+        plugin, _, filename = route[len("preflight-v2/get-script/") :].partition("/")
+        with self.server.state.lock:
+            matches = [
+                s
+                for s in self.server.state.scripts
+                if s["plugin"] == plugin and s["filename"] == filename
+            ]
+        if matches:
+            self.respond(200, json.dumps(matches).encode(), "application/json")
+        else:
+            self.respond(404, b"Not found")
+
+    def parse_json(self, body):
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body)
+        # Form-encoded submissions.
+        return dict(urllib.parse.parse_qsl(body.decode()))
+
+    def respond(self, status, body, content_type="text/plain", headers=None):
+        method, route, size, encoding = self.request_info
+        # Recorded before responding, so that a client which has its
+        # response can count on the request having been recorded.
+        self.server.state.record(method, route, status, size, encoding, len(body))
+        self.pace(len(body))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_cacheable(self, body, content_type="text/plain"):
+        """Respond with body and an ETag, or 304 if the client has it."""
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        if_none_match = self.headers.get("If-None-Match", "")
+        if etag in (t.strip() for t in if_none_match.split(",")):
+            self.respond(304, b"", content_type, {"ETag": etag})
+        else:
+            self.respond(200, body, content_type, {"ETag": etag})
+
+    def log_message(self, format, *args):
+        logging.debug("%s %s", self.address_string(), format % args)
+
+
+def decode_submission(data):
+    """Decode a `sal.submission_encode` payload, whatever its codec."""
+    compressed = base64.b64decode(data)
+    if compressed.startswith(b"BZh"):
+        return bz2.decompress(compressed)
+    if compressed.startswith(b"\xfd7zXZ"):
+        return lzma.decompress(compressed)
+    try:
+        return zlib.decompress(compressed)
+    except zlib.error as error:
+        raise ValueError(f"Unknown submission encoding: {error}") from None
+
+
+def make_server(
+    host="127.0.0.1",
+    port=0,
+    accept_encodings=("gzip", "zstd"),
+    latency=0.0,
+    error_rate=0.0,
+    bandwidth=None,
+    scripts=None,
+    seed=None,
+):
+    """Return a stand-in server; port 0 picks a free port.
+
+    The server's `state` attribute records reports and requests, and
+    `url` is its base URL. Request bodies with a Content-Encoding not
+    in accept_encodings are refused with HTTP 415. See the module
+    docstring for latency, error_rate and bandwidth; seed makes the
+    injected errors repeatable.
+    """
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    server.daemon_threads = True
+    server.state = StandinState(
+        accept_encodings,
+        latency=latency,
+        error_rate=error_rate,
+        bandwidth=bandwidth,
+        scripts=scripts,
+        seed=seed,
+    )
+    server.url = f"http://{host}:{server.server_address[1]}"
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=8000, type=int)
+    parser.add_argument(
+        "--accept-encoding",
+        action="append",
+        help="Request Content-Encoding to accept; may be repeated. Defaults to "
+        "gzip and zstd. Pass 'none' to refuse all compressed bodies.",
+    )
+    parser.add_argument(
+        "--latency", default=0.0, type=float, help="Seconds to delay each request."
+    )
+    parser.add_argument(
+        "--error-rate",
+        default=0.0,
+        type=float,
+        help="Fraction of requests (0-1) to answer with HTTP 503.",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=int,
+        help="Bytes per second to pace request and response bodies to.",
+    )
+    parser.add_argument("--seed", type=int, help="Seed for injected errors.")
+    parser.add_argument("-d", "--debug", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    encodings = args.accept_encoding or ("gzip", "zstd")
+    server = make_server(
+        args.host,
+        args.port,
+        accept_encodings=encodings,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        bandwidth=args.bandwidth,
+        seed=args.seed,
+    )
+    logging.info("Sal stand-in server listening on %s", server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""simulate_fleet
+
+Model the load a fleet of Sal clients puts on the server.
+
+Every virtual client follows the schedule a real Mac does:
+
+- com.salopensource.sal.random.runner runs `randomizer --delay 1500`
+  at load and then every 1800 seconds, and randomizer sleeps for its
+  chosen delay before starting sal-submit.
+- Munki's hourly check starts at ten past the hour (for the whole
+  fleet at once), is spread over the hour by its random delay, and its
+  postflight starts sal-submit when the Munki run finishes.
+
+The delays come from the payload's own randomizer, so changes to its
+scheduling show up here; --mode slot uses its per-machine slots
+instead of fresh random delays. Clients boot at random within --boot-window
+seconds of the start; a small window models a fleet waking together.
+
+By default the schedule is only modeled: each sal-submit run is taken
+to last --run-duration seconds. With --live, each run sends a checkin
+and an inventory hash check through its own SalClient to an in-process
+stand-in server, replayed --scale times faster than real time. The
+server then sees --scale times the fleet's request rate, and the
+measured concurrency is for that compressed load.
+
+Reports sal-submit runs (and with --live, requests) per second at
+percentiles over --bucket second windows, and peak concurrency.
+
+    tools/simulate_fleet.py --clients 20000 --duration 14400
+    tools/simulate_fleet.py --clients 500 --duration 3600 --live --scale 60
+"""
+
+
+import argparse
+import concurrent.futures
+import importlib.machinery
+import importlib.util
+import logging
+import pathlib
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "sal_python_pkg"))
+from sal.client import RetryPolicy, SalClient
+
+from bench_client_e2e import make_report
+from sal_standin_server import make_server
+
+
+PAYLOAD_BIN = pathlib.Path(__file__).resolve().parents[1] / "payload/usr/local/sal/bin"
+# From com.salopensource.sal.random.runner.plist.
+LAUNCHD_INTERVAL = 1800
+RANDOMIZER_DELAY = 1500
+# Munki's managedsoftwareupdate-check runs hourly at ten past, with up
+# to an hour of random delay.
+MUNKI_INTERVAL = 3600
+MUNKI_OFFSET = 600
+MUNKI_DELAY = 3600
+
+
+def load_randomizer():
+    path = PAYLOAD_BIN / "randomizer"
+    loader = importlib.machinery.SourceFileLoader("randomizer", str(path))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def schedule_runs(args, randomizer, rng):
+    """Return (start, client, trigger) for every sal-submit run, by start."""
+    runs = []
+    for client in range(args.clients):
+        boot = rng.uniform(0, args.boot_window)
+        fire = boot
+        identifier = f"SIM{client:08d}" if args.mode == "slot" else None
+        while fire < args.duration:
+            delay = randomizer.choose_delay(args.delay, identifier, now=fire)
+            runs.append((fire + delay, client, "launchd"))
+            fire += args.interval
+
+        if args.munki:
+            hour = 0
+            while (check := hour * MUNKI_INTERVAL + MUNKI_OFFSET) < args.duration:
+                if check >= boot:
+                    start = check + rng.uniform(0, MUNKI_DELAY) + args.munki_duration
+                    runs.append((start, client, "munki"))
+                hour += 1
+    return sorted(r for r in runs if r[0] < args.duration)
+
+
+def rate_percentiles(times, duration, bucket):
+    """Return per-second rates at percentiles over bucket-second windows."""
+    counts = [0] * max(1, int(duration // bucket))
+    for when in times:
+        index = int(when // bucket)
+        if index < len(counts):
+            counts[index] += 1
+    rates = sorted(count / bucket for count in counts)
+    percentiles = {
+        f"p{p}": rates[min(len(rates) - 1, int(len(rates) * p / 100))]
+        for p in (50, 90, 99)
+    }
+    percentiles.update(max=rates[-1], mean=sum(rates) / len(rates))
+    return percentiles
+
+
+def peak_concurrency(intervals):
+    """Return the most intervals (start, end) open at any one time."""
+    events = []
+    for start, end in intervals:
+        events.append((start, 1))
+        events.append((end, -1))
+    # Ends sort before starts at the same moment.
+    peak = current = 0
+    for _, change in sorted(events):
+        current += change
+        peak = max(peak, current)
+    return peak
+
+
+def run_live(runs, args):
+    """Replay runs against a stand-in server; return request intervals.
+
+    Intervals are (start, end) in simulated seconds.
+    """
+    server = make_server(latency=args.latency, error_rate=args.error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    rng = random.Random(args.seed)
+    reports = {}
+    clients = {}
+    intervals = []
+    lock = threading.Lock()
+    started = time.monotonic()
+
+    def now():
+        return (time.monotonic() - started) * args.scale
+
+    def sal_submit(client_id):
+        if client_id not in clients:
+            client = SalClient()
+            client.base_url = server.url
+            client.auth = ("sal", "simkey")
+            client.retry_policy = RetryPolicy(attempts=1)
+            clients[client_id] = client
+        client = clients[client_id]
+        serial = f"SIM{client_id:08d}"
+        requests = (
+            lambda: client.post("checkin/", json=reports[client_id]),
+            lambda: client.get(f"inventory/hash/{serial}/"),
+        )
+        for request in requests:
+            start = now()
+            try:
+                request()
+            except Exception as error:
+                logging.debug("Client %d request failed: %s", client_id, error)
+            with lock:
+                intervals.append((start, now()))
+
+    for _, client_id, _ in runs:
+        if client_id not in reports:
+            serial = f"SIM{client_id:08d}"
+            reports[client_id] = make_report(args.managed_items, rng, serial)
+
+    lag = 0.0
+    with concurrent.futures.ThreadPoolExecutor(args.workers) as pool:
+        for start, client_id, _ in runs:
+            wait = start / args.scale - (time.monotonic() - started)
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                lag = max(lag, -wait * args.scale)
+            pool.submit(sal_submit, client_id)
+
+    totals = server.state.totals()
+    server.shutdown()
+    return intervals, totals, lag
+
+
+def report(label, times, intervals, duration, bucket):
+    rates = rate_percentiles(times, duration, bucket)
+    print(
+        f"{label:<9} {len(times):>8} {rates['mean']:>7.2f} {rates['p50']:>7.2f} "
+        f"{rates['p90']:>7.2f} {rates['p99']:>7.2f} {rates['max']:>7.2f} "
+        f"{peak_concurrency(intervals):>6}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument(
+        "--duration", type=float, default=4 * 3600, help="Simulated seconds."
+    )
+    parser.add_argument(
+        "--boot-window",
+        type=float,
+        default=LAUNCHD_INTERVAL,
+        help="Clients boot at random within this many seconds of the start.",
+    )
+    parser.add_argument("--interval", type=float, default=LAUNCHD_INTERVAL)
+    parser.add_argument("--delay", type=int, default=RANDOMIZER_DELAY)
+    parser.add_argument(
+        "--mode",
+        choices=("random", "slot"),
+        default="random",
+        help="randomizer mode; slot derives each client's slot from its serial.",
+    )
+    parser.add_argument(
+        "--no-munki",
+        dest="munki",
+        action="store_false",
+        help="Leave out runs started by Munki's postflight.",
+    )
+    parser.add_argument(
+        "--munki-duration", type=float, default=120, help="Seconds per Munki run."
+    )
+    parser.add_argument(
+        "--run-duration",
+        type=float,
+        default=5,
+        help="Seconds a sal-submit run takes, when not --live.",
+    )
+    parser.add_argument("--bucket", type=float, default=60, help="Rate window.")
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--scale", type=float, default=60, help="Live speedup.")
+    parser.add_argument("--workers", type=int, default=64, help="Live threads.")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--managed-items", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-d", "--debug", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    randomizer = load_randomizer()
+    randomizer.random.seed(args.seed)
+    runs = schedule_runs(args, randomizer, random.Random(args.seed))
+    triggers = {}
+    for _, _, trigger in runs:
+        triggers[trigger] = triggers.get(trigger, 0) + 1
+    print(
+        f"{len(runs)} sal-submit runs from {args.clients} clients over "
+        f"{args.duration:.0f}s: "
+        + ", ".join(f"{count} by {name}" for name, count in sorted(triggers.items()))
+    )
+    print(
+        f"{'':<9} {'count':>8} {'mean/s':>7} {'p50/s':>7} {'p90/s':>7} "
+        f"{'p99/s':>7} {'max/s':>7} {'peak':>6}"
+    )
+    starts = [start for start, _, _ in runs]
+    report(
+        "runs",
+        starts,
+        [(start, start + args.run_duration) for start in starts],
+        args.duration,
+        args.bucket,
+    )
+
+    if args.live:
+        intervals, totals, lag = run_live(runs, args)
+        report(
+            "requests",
+            [start for start, _ in intervals],
+            intervals,
+            args.duration,
+            args.bucket,
+        )
+        print(
+            f"Server saw {totals['requests']} requests ({totals['errors']} errors); "
+            f"runs started up to {lag:.1f} simulated seconds late"
+        )
+
+
+if __name__ == "__main__":
+    main()